@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# Usage:
+#   python etc/importtime.py [--repeat N] [--out FILE]
+#
+# Records start-up times for `run.py --help` and for importing each generator
+# using `python -X importtime`. For each target, the wall time of the process
+# and the cumulative import time of hapimeta (and its generator) is reported.
+# The slowest third-party imports are listed to find imports that should be
+# moved into the functions that use them.
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def generators():
+  import pkgutil
+  path = os.path.join(ROOT, 'hapimeta', 'generators')
+  return sorted(name for _, name, _ in pkgutil.iter_modules([path]))
+
+
+def targets():
+  targets = {'run.py --help': [os.path.join(ROOT, 'run.py'), '--help']}
+  for name in generators():
+    targets[name] = ['-c', f'import hapimeta.generators.{name}']
+  return targets
+
+
+def parse(stderr):
+  """Return {module: (self_us, cumulative_us, depth)} from -X importtime output."""
+  modules = {}
+  for line in stderr.splitlines():
+    if not line.startswith('import time:') or 'imported package' in line:
+      continue
+    self_us, cumulative_us, name = line[len('import time:'):].split('|')
+    depth = (len(name) - len(name.lstrip())) // 2
+    modules[name.strip()] = (int(self_us), int(cumulative_us), depth)
+  return modules
+
+
+def measure(argv):
+  env = os.environ.copy()
+  env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+  start = time.perf_counter()
+  result = subprocess.run([sys.executable, '-X', 'importtime', *argv], cwd=ROOT, env=env,
+                          capture_output=True, text=True)
+  wall = time.perf_counter() - start
+  if result.returncode != 0:
+    raise RuntimeError(result.stderr.strip().splitlines()[-1])
+  return wall, parse(result.stderr)
+
+
+def summarize(wall, modules, top):
+  # Top-level imports have depth 0 (after the leading space); their
+  # cumulative times sum to the total import time.
+  total = sum(c for _, c, depth in modules.values() if depth == 0)
+  hapimeta_us = max((c for name, (_, c, _) in modules.items() if name.startswith('hapimeta')), default=0)
+  third_party = [
+    (name, c) for name, (_, c, depth) in modules.items()
+    if depth <= 1 and c >= 1000 and not name.startswith('hapimeta') and name.split('.')[0] not in sys.stdlib_module_names
+  ]
+  third_party.sort(key=lambda item: item[1], reverse=True)
+  return {
+    'wall_s': round(wall, 4),
+    'imports_s': round(total/1e6, 4),
+    'hapimeta_s': round(hapimeta_us/1e6, 4),
+    'n_modules': len(modules),
+    'slowest': [[name, round(c/1e6, 4)] for name, c in third_party[:top]]
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Record start-up times of run.py and the generators.')
+  parser.add_argument('--repeat', type=int, default=3, help='Runs per target; the fastest is reported.')
+  parser.add_argument('--top', type=int, default=5, help='Number of slowest third-party imports to list.')
+  parser.add_argument('--out', default=None, help='Write results as JSON to this file.')
+  args = parser.parse_args()
+
+  results = {}
+  for label, argv in targets().items():
+    try:
+      runs = [measure(argv) for _ in range(max(1, args.repeat))]
+    except RuntimeError as exc:
+      print(f'{label:24s} failed: {exc}')
+      results[label] = {'error': str(exc)}
+      continue
+    wall, modules = min(runs, key=lambda run: run[0])
+    results[label] = summarize(wall, modules, args.top)
+    r = results[label]
+    slowest = ', '.join(f'{name} {s:.3f}' for name, s in r['slowest'])
+    print(f"{label:24s} wall {r['wall_s']:.3f}s  imports {r['imports_s']:.3f}s  modules {r['n_modules']:4d}  {slowest}")
+
+  if args.out is not None:
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, 'w') as fout:
+      json.dump(results, fout, indent=2)
+    print(f'Wrote {args.out}')
+
+
+if __name__ == '__main__':
+  main()
@@ -11,19 +11,33 @@ from hapimeta.config import config
 
 DATA_DIR = config('common')['DATA_DIR']
 
-all     = importlib.import_module('hapimeta.all').all
-cli     = importlib.import_module('hapimeta.cli').cli
-error   = importlib.import_module('hapimeta.error')
-get     = importlib.import_module('hapimeta.get').get
-logger  = importlib.import_module('hapimeta.logger').logger
+aget      = importlib.import_module('hapimeta.get').aget
+all       = importlib.import_module('hapimeta.all').all
+cli       = importlib.import_module('hapimeta.cli').cli
+error     = importlib.import_module('hapimeta.error')
+get       = importlib.import_module('hapimeta.get').get
+hapitime  = importlib.import_module('hapimeta.hapitime')
+lazy      = importlib.import_module('hapimeta.lazy').lazy
+logger    = importlib.import_module('hapimeta.logger').logger
+scheduler = importlib.import_module('hapimeta.scheduler')
+sessions  = importlib.import_module('hapimeta.sessions')
+shards    = importlib.import_module('hapimeta.shards')
+tabledb   = importlib.import_module('hapimeta.tabledb')
 
 __all__ = [
   '__version__',
   'config',
   'DATA_DIR',
+  'aget',
   'all',
   'get',
+  'hapitime',
+  'lazy',
   'logger',
   'cli',
-  'error'
+  'error',
+  'scheduler',
+  'sessions',
+  'shards',
+  'tabledb'
 ]
\ No newline at end of file
@@ -1,4 +1,12 @@
-def all(log):
+def all(log, readonly=False):
+  """
+  Return a mapping of server_id to the server's catalogs-all content.
+
+  Data read from disk is kept for the life of the process, so when run.py
+  runs several generators, each file is read once. Each call returns its own
+  copy of the content, which the caller may modify. Callers that do not
+  modify it can pass readonly=True to share a single copy.
+  """
   import os
   import utilrsw
   import hapimeta
@@ -7,6 +15,10 @@ def all(log):
   cfg_common = hapimeta.config('common')
 
   if args.use_remote_catalog:
+    all = _remote_shards(args, cfg_common, log, readonly=readonly)
+    if all is not None:
+      return all
+
     url = cfg_common['ALL_FILE_REMOTE']
     file = os.path.join(hapimeta.DATA_DIR, 'tmp', cfg_common['ALL_FILE'])
     log.info(f"Downloading {url} to {file}")
@@ -19,6 +31,12 @@ def all(log):
     file_path = info['cache_file']
   else:
     file_path = os.path.join(hapimeta.DATA_DIR, cfg_common['ALL_FILE'])
+    shard_dir = os.path.join(hapimeta.DATA_DIR, cfg_common['ALL_DIR'])
+    index = hapimeta.shards.read_index(shard_dir)
+    if index is not None:
+      log.info(f'Using server index in {shard_dir}; server metadata is read when first used.')
+      all = hapimeta.shards.Shards(shard_dir, index, log=log, readonly=readonly)
+      return _subset(all, args, log)
 
   log.info(f'Reading {file_path}')
   if not os.path.exists(file_path):
@@ -28,22 +46,82 @@ def all(log):
       f"or pass --use-remote-catalog to download it without locally generating it."
     )
     raise FileNotFoundError(f"File not found: {file_path}")
-  all = utilrsw.read(file_path)
+  all = _read(file_path, log).view(readonly=readonly)
+
+  return _subset(all, args, log)
+
+
+def _read(file_path, log):
+  """
+  Read catalogs-all.pkl once per process (or again if it changed). Views of
+  the returned Shards copy a server's content when it is first used unless
+  they are readonly.
+  """
+  import os
+  import utilrsw
+  import hapimeta
+
+  stat = os.stat(file_path)
+  key = (file_path, stat.st_mtime_ns, stat.st_size)
+  if _read.key != key:
+    _read.all = hapimeta.shards.Shards.from_dict(utilrsw.read(file_path), log=log)
+    _read.key = key
+  else:
+    log.info(f'Using {file_path} read earlier in this process')
+  return _read.all
+
+_read.key = None
+_read.all = None
 
 
+def _remote_shards(args, cfg_common, log, readonly=False):
+  """
+  Download only the shards in ALL_DIR_REMOTE that are needed and have changed.
+  Returns None if the remote index is not available.
+  """
+  import os
+  import hapimeta
+
+  url = cfg_common['ALL_DIR_REMOTE']
+  index_url = f'{url}/{hapimeta.shards.INDEX_FILE}'
+  try:
+    index = hapimeta.get(index_url, log=log)
+  except Exception:
+    log.info(f'Could not get {index_url}. Using {cfg_common["ALL_FILE_REMOTE"]}.')
+    return None
+
+  shard_dir = os.path.join(hapimeta.DATA_DIR, 'tmp', cfg_common['ALL_DIR'])
+  all = hapimeta.shards.Shards(shard_dir, index, log=log, readonly=readonly)
+  all = _subset(all, args, log)
+  index = hapimeta.shards.sync(url, shard_dir, index, list(all.keys()), log)
+
+  # Servers whose download failed use the entry of the earlier download.
+  return hapimeta.shards.Shards(shard_dir, index, log=log, readonly=readonly)
+
+
+def _subset(all, args, log):
+
   subset = False
   if args.servers is not None:
     subset = True
     all_ids = set(all.keys())
-    all = {server_id: server_meta for server_id, server_meta in all.items() if server_id in args.servers}
-    if not all:
+    server_ids = [server_id for server_id in all.keys() if server_id in args.servers]
+    if not server_ids:
       log.error(f'No matching server ids found in catalogs-all.pkl. Check that --servers has {args.servers} and that the server ids exist in catalogs-all.pkl: {all_ids}')
       exit(1)
+    all = _select(all, server_ids)
   if args.n_servers is not None:
     subset = True
-    all = dict(list(all.items())[:args.n_servers])
+    all = _select(all, list(all.keys())[:args.n_servers])
 
   server_names = f'all {len(all)} servers' if not subset else f'servers {args.servers}'
   log.info(f'Using {server_names} for generating content')
 
-  return all
\ No newline at end of file
+  return all
+
+
+def _select(all, server_ids):
+  import hapimeta
+  if isinstance(all, hapimeta.shards.Shards):
+    return all.subset(server_ids)
+  return {server_id: all[server_id] for server_id in server_ids}
\ No newline at end of file
@@ -22,34 +22,80 @@ def commands():
   return command_names
 
 
+def dependencies():
+  """
+  Return a dict of command names and the commands they depend on.
+
+  abouts updates the list of servers used by catalogs, and all other
+  commands read the output of catalogs.
+  """
+  deps = {}
+  for command_name in commands():
+    if command_name == 'abouts':
+      deps[command_name] = []
+    elif command_name == 'catalogs':
+      deps[command_name] = ['abouts']
+    else:
+      deps[command_name] = ['catalogs']
+  return deps
+
+
 def cli():
   # Usage
   #    python run.py [generator] [--servers server1,server2,...]
   # where generator is one of abouts, catalogs, availabilities, table,
 
-  import os
-  import argparse
+  # Parsed arguments are cached because cli() is called by run.py, each
+  # generator, and hapimeta.all(). run.py changes sys.argv before running a
+  # generator, so the cache is keyed on sys.argv.
   import sys
 
-  import utilrsw
+  argv = tuple(sys.argv[1:])
+  if cli.cache is not None and cli.cache[0] == argv:
+    return cli.cache[1]
 
-  available_commands = tuple(commands())
-  remote_catalog_commands = {'availabilities', 'relations', 'spase', 'table'}
+  args = _parse(argv)
+  cli.cache = (argv, args)
+  return args
+
+cli.cache = None
 
+
+def _servers_help(argv):
   servers_help = 'Comma-separated list of server IDs'
-  catalogs_file = os.path.join(hapimeta.DATA_DIR, 'catalogs.pkl')
+  if '-h' not in argv and '--help' not in argv:
+    return servers_help
+
+  # Only the small server index written by catalogs is read, and only when
+  # help is requested.
+  import os
+  shard_dir = os.path.join(hapimeta.DATA_DIR, hapimeta.config('common')['ALL_DIR'])
   try:
-    server_ids = sorted(utilrsw.read(catalogs_file).keys())
+    server_ids = sorted(hapimeta.shards.read_index(shard_dir).keys())
     if server_ids:
       servers_help += f". Choices: {', '.join(server_ids)}"
   except Exception:
     pass
 
+  return servers_help
+
+
+def _parse(argv):
+  import argparse
+  import sys
+
+  available_commands = tuple(commands())
+  remote_catalog_commands = {'availabilities', 'relations', 'spase', 'table'}
+  workers_commands = {'availabilities', 'table'}
+
+  servers_help = _servers_help(argv)
+
   ALL_FILE_REMOTE = hapimeta.config('common')['ALL_FILE_REMOTE']
 
   epilog = [
     'Examples:',
     '  python run.py',
+    '  python run.py --jobs 4',
     '',
     '  python run.py abouts',
     '  python run.py abouts --servers CDAWeb',
@@ -58,7 +104,11 @@ def cli():
     '',
     '  python run.py spase',
     '  python run.py spase --servers TestData2.0,TestData3.0',
-    '  python run.py spase --servers TestData2.0,TestData3.0 --n-datasets 1'
+    '  python run.py spase --servers TestData2.0,TestData3.0 --n-datasets 1',
+    '',
+    '  python run.py catalogs --engine async',
+    '  python run.py availabilities --workers 8',
+    '  python run.py table --workers 8'
   ]
   command_list = ', '.join(available_commands)
 
@@ -104,6 +154,51 @@ def cli():
       f"{', '.join(sorted(remote_catalog_commands))})"
     ),
   )
+  parser.add_argument(
+    '--engine',
+    default=None,
+    choices=('threads', 'async'),
+    help=(
+      'Request engine for catalogs. async requires aiohttp (pip install -e .[async]). '
+      'Default is catalogs.engine in run.json.'
+    ),
+  )
+  parser.add_argument(
+    '--incremental',
+    action='store_true',
+    help=(
+      'For catalogs, only request /info for new and changed datasets and a rotating sample of '
+      'the others. Other /info responses are read from the last run. '
+      'For table, only update the rows of servers whose metadata changed since the last run. '
+      'Also enabled by incremental in the command\'s section of run.json.'
+    ),
+  )
+  parser.add_argument(
+    '--resume',
+    action='store_true',
+    help=(
+      'For catalogs, continue an interrupted run: /info responses recorded in '
+      f'{hapimeta.DATA_DIR}/catalogs-journal.jsonl are read from disk instead of requested.'
+    ),
+  )
+  parser.add_argument(
+    '--jobs',
+    type=int,
+    default=None,
+    help=(
+      'When running all commands, run up to this many at the same time in separate '
+      'processes. Commands are started when the commands they depend on have finished.'
+    ),
+  )
+  parser.add_argument(
+    '--workers',
+    type=int,
+    default=None,
+    help=(
+      f"For {', '.join(sorted(workers_commands))}, process servers in this many processes. "
+      'Default is workers in the command\'s section of run.json.'
+    ),
+  )
   parser.add_argument(
     '--email-on-exception',
     dest='email_on_exception',
@@ -111,7 +206,7 @@ def cli():
     help='Send an email when run.py catches an uncaught generator exception.',
   )
 
-  args, _ = parser.parse_known_args()
+  args, _ = parser.parse_known_args(argv)
 
   if args.command is not None and args.command not in available_commands:
     parser.error(f'Unknown command: {args.command}')
@@ -120,11 +215,26 @@ def cli():
     parser.error('--n-servers must be >= 0')
   if args.n_datasets is not None and args.n_datasets < 0:
     parser.error('--n-datasets must be >= 0')
+  if args.jobs is not None and args.jobs < 1:
+    parser.error('--jobs must be >= 1')
+  if args.workers is not None and args.workers < 1:
+    parser.error('--workers must be >= 1')
   if args.use_remote_catalog and args.command is not None and args.command not in remote_catalog_commands:
     parser.error(
       f"--use-remote-catalog is not used by '{args.command}'. "
       f"Supported commands: {', '.join(sorted(remote_catalog_commands))}"
     )
+  if args.engine is not None and args.command is not None and args.command != 'catalogs':
+    parser.error(f"--engine is not used by '{args.command}'. Supported commands: catalogs")
+  if args.incremental and args.command is not None and args.command not in ('catalogs', 'table'):
+    parser.error(f"--incremental is not used by '{args.command}'. Supported commands: catalogs, table")
+  if args.resume and args.command is not None and args.command != 'catalogs':
+    parser.error(f"--resume is not used by '{args.command}'. Supported commands: catalogs")
+  if args.workers is not None and args.command is not None and args.command not in workers_commands:
+    parser.error(
+      f"--workers is not used by '{args.command}'. "
+      f"Supported commands: {', '.join(sorted(workers_commands))}"
+    )
 
   if args.servers is None:
     args.servers = None
@@ -1,5 +1,6 @@
 def config(part):
   import os
+  import copy
   import json
 
   if part != 'common':
@@ -12,10 +13,14 @@ def config(part):
   if part != 'common':
     log.info(f"Reading config from {fname}")
 
-  with open(fname) as fin:
-    run_config = json.load(fin)
+  # run.json is parsed once per process; each caller gets its own copy.
+  if config.run_config is None:
+    with open(fname) as fin:
+      config.run_config = json.load(fin)
 
   if part != 'common':
     log.info(f"Extracting {part} from config")
 
-  return run_config[part].copy()
\ No newline at end of file
+  return copy.deepcopy(config.run_config[part])
+
+config.run_config = None
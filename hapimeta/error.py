@@ -1,18 +1,23 @@
+import threading
+
 import hapimeta
 
 
 def store(server, dataset, message, logger):
   logger.error(f"    {server} {dataset}: {message}")
 
-  if server not in store.errors:
-    store.errors[server] = {}
+  # Lock needed because catalogs makes requests to a server from many threads.
+  with store.lock:
+    if server not in store.errors:
+      store.errors[server] = {}
 
-  if dataset not in store.errors[server]:
-    store.errors[server][dataset] = []
+    if dataset not in store.errors[server]:
+      store.errors[server][dataset] = []
 
-  store.errors[server][dataset].append(message.lstrip())
+    store.errors[server][dataset].append(message.lstrip())
 
 store.errors = {}
+store.lock = threading.Lock()
 
 
 def combine():
@@ -2,8 +2,8 @@ import utilrsw
 
 import hapimeta
 
-log = hapimeta.logger('abouts')
-cfg = hapimeta.config('abouts')
+log = hapimeta.lazy(hapimeta.logger, 'abouts')
+cfg = hapimeta.lazy(hapimeta.config, 'abouts')
 
 def run():
   args = hapimeta.cli()
@@ -0,0 +1,294 @@
+// Draws the availability of the datasets of a HAPI server from the
+// SERVER/SERVER.intervals.json file written by availabilities.py.
+//
+// Usage: availabilities-viewer.html?server=SERVER
+//
+// Wheel scrolls datasets, Ctrl+wheel (or Shift+wheel) zooms the time axis,
+// dragging pans it, double-click resets the view, clicking a bar opens the
+// dataset's page (Alt+click opens its plots), and the filter input shows only datasets whose ID
+// contains the text.
+
+(function () {
+  'use strict';
+
+  // matplotlib's default color cycle, which the SVG and PNG plots use.
+  const colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd',
+                  '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf'];
+  const rowHeight = 14;
+  const axisHeight = 22;
+  const font = '11px "Times New Roman", "DejaVu Sans", serif';
+
+  const canvas = document.getElementById('canvas');
+  const ctx = canvas.getContext('2d');
+  const tip = document.getElementById('tip');
+
+  let data = null;
+  let rows = [];     // Indices of intervals that match the filter.
+  let top = 0;       // Index in rows of the first row drawn.
+  let tMin = 0;
+  let tMax = 1;
+  let view = [0, 1]; // Time range drawn, in epoch seconds.
+  let drag = null;
+
+  const server = new URLSearchParams(window.location.search).get('server');
+  if (server === null) {
+    message('No server given. Use ?server=SERVER.');
+    return;
+  }
+
+  // Same layout as data/availabilities: SERVER/basename(SERVER).intervals.json
+  fetch(encodeURI(`${server}/${server.split('/').pop()}.intervals.json`))
+    .then(response => {
+      if (!response.ok) {
+        throw new Error(`${response.status} ${response.statusText}`);
+      }
+      return response.json();
+    })
+    .then(init)
+    .catch(err => message(`Could not read intervals for ${server}: ${err.message}`));
+
+  function message(text) {
+    document.getElementById('title').textContent = text;
+  }
+
+  function init(json) {
+    data = json;
+    message(data.title);
+    // Initial view is clipped as in the SVG and PNG plots.
+    const clipMin = Date.UTC(1960, 0, 1) / 1000;
+    const clipMax = Date.now() / 1000 + 5 * 365 * 86400;
+    tMin = Math.max(clipMin, data.start.reduce((a, b) => Math.min(a, b), Infinity));
+    tMax = Math.min(clipMax, data.stop.reduce((a, b) => Math.max(a, b), -Infinity));
+    if (tMax <= tMin) {
+      tMax = tMin + 86400;
+    }
+    view = [tMin, tMax];
+    filter('');
+    window.addEventListener('resize', resize);
+    resize();
+  }
+
+  function filter(text) {
+    const query = text.trim().toLowerCase();
+    rows = [];
+    for (let i = 0; i < data.dataset.length; i++) {
+      if (query === '' || data.ids[data.dataset[i]].toLowerCase().includes(query)) {
+        rows.push(i);
+      }
+    }
+    top = 0;
+    document.getElementById('count').textContent = `${rows.length}/${data.dataset.length} datasets`;
+    draw();
+  }
+
+  function resize() {
+    const ratio = window.devicePixelRatio || 1;
+    const width = canvas.parentElement.clientWidth;
+    const height = canvas.parentElement.clientHeight;
+    canvas.width = width * ratio;
+    canvas.height = height * ratio;
+    canvas.style.width = `${width}px`;
+    canvas.style.height = `${height}px`;
+    ctx.setTransform(ratio, 0, 0, ratio, 0, 0);
+    draw();
+  }
+
+  function size() {
+    const ratio = window.devicePixelRatio || 1;
+    return [canvas.width / ratio, canvas.height / ratio];
+  }
+
+  function x(t) {
+    return (t - view[0]) / (view[1] - view[0]) * size()[0];
+  }
+
+  function t(x) {
+    return view[0] + x / size()[0] * (view[1] - view[0]);
+  }
+
+  function visibleRows() {
+    return Math.max(1, Math.floor((size()[1] - axisHeight) / rowHeight));
+  }
+
+  function draw() {
+    if (data === null) {
+      return;
+    }
+    const [width, height] = size();
+    ctx.clearRect(0, 0, width, height);
+    ctx.font = font;
+    ctx.textBaseline = 'middle';
+
+    const plotHeight = height - axisHeight;
+    for (const tick of ticks(view[0], view[1])) {
+      const xt = x(tick.t);
+      ctx.strokeStyle = 'rgba(0, 0, 0, 0.3)';
+      ctx.beginPath();
+      ctx.moveTo(xt, 0);
+      ctx.lineTo(xt, plotHeight);
+      ctx.stroke();
+      ctx.fillStyle = '#000';
+      ctx.textAlign = 'center';
+      ctx.fillText(tick.label, xt, plotHeight + axisHeight / 2);
+    }
+
+    const n = visibleRows();
+    for (let r = 0; r < n && top + r < rows.length; r++) {
+      const i = rows[top + r];
+      const y = r * rowHeight + rowHeight / 2;
+      const x0 = x(data.start[i]);
+      const x1 = Math.max(x0 + 1, x(data.stop[i]));
+      const color = colors[i % colors.length];
+      ctx.fillStyle = color;
+      ctx.fillRect(x0, y - 0.4 * rowHeight, x1 - x0, 0.8 * rowHeight);
+      ctx.textAlign = 'left';
+      const xl = Math.min(Math.max(x1 + 2, 2), width - 2);
+      ctx.fillText(data.ids[data.dataset[i]], xl, y);
+    }
+  }
+
+  function ticks(t0, t1) {
+    // Steps are [seconds, unit, n]; the first giving at most maxTicks is used.
+    const maxTicks = Math.max(2, Math.floor(size()[0] / 90));
+    const hour = 3600;
+    const day = 86400;
+    const steps = [
+      [hour, 'hour', 1], [3 * hour, 'hour', 3], [6 * hour, 'hour', 6], [12 * hour, 'hour', 12],
+      [day, 'day', 1], [2 * day, 'day', 2], [5 * day, 'day', 5], [10 * day, 'day', 10],
+      [30.44 * day, 'month', 1], [91.3 * day, 'month', 3], [182.6 * day, 'month', 6],
+      [365.25 * day, 'year', 1], [730.5 * day, 'year', 2], [1826 * day, 'year', 5],
+      [3652 * day, 'year', 10], [7305 * day, 'year', 20], [18262 * day, 'year', 50],
+      [36525 * day, 'year', 100]
+    ];
+    let step = steps[steps.length - 1];
+    for (const s of steps) {
+      if ((t1 - t0) / s[0] <= maxTicks) {
+        step = s;
+        break;
+      }
+    }
+    const [, unit, n] = step;
+
+    const out = [];
+    const d = new Date(t0 * 1000);
+    let year = d.getUTCFullYear();
+    let month = d.getUTCMonth();
+    if (unit === 'year') {
+      year = year - year % n;
+      month = 0;
+    } else if (unit === 'month') {
+      month = month - month % n;
+    }
+    let tick = unit === 'year' || unit === 'month'
+      ? Date.UTC(year, month, 1) / 1000
+      : Math.floor(t0 / (n * (unit === 'day' ? day : hour))) * n * (unit === 'day' ? day : hour);
+
+    while (tick <= t1 && out.length < 1000) {
+      if (tick >= t0) {
+        out.push({t: tick, label: label(tick, unit)});
+      }
+      if (unit === 'year' || unit === 'month') {
+        const next = new Date(tick * 1000);
+        if (unit === 'year') {
+          next.setUTCFullYear(next.getUTCFullYear() + n);
+        } else {
+          next.setUTCMonth(next.getUTCMonth() + n);
+        }
+        tick = next.getTime() / 1000;
+      } else {
+        tick += n * (unit === 'day' ? day : hour);
+      }
+    }
+    return out;
+  }
+
+  function label(tick, unit) {
+    const iso = new Date(tick * 1000).toISOString();
+    return {year: iso.slice(0, 4), month: iso.slice(0, 7), day: iso.slice(0, 10), hour: iso.slice(0, 13)}[unit];
+  }
+
+  function rowAt(event) {
+    const rect = canvas.getBoundingClientRect();
+    const r = Math.floor((event.clientY - rect.top) / rowHeight);
+    if (r < 0 || r >= visibleRows() || top + r >= rows.length) {
+      return null;
+    }
+    const i = rows[top + r];
+    const xe = event.clientX - rect.left;
+    if (xe < x(data.start[i]) - 2 || xe > Math.max(x(data.start[i]) + 1, x(data.stop[i])) + 2) {
+      return null;
+    }
+    return i;
+  }
+
+  function link(template, i) {
+    return template
+      .replace('{server}', encodeURIComponent(data.server))
+      .replace('{server_url}', data.url)
+      .replace('{dataset}', encodeURIComponent(data.ids[data.dataset[i]]));
+  }
+
+  function iso(seconds) {
+    return new Date(seconds * 1000).toISOString().replace('.000Z', 'Z');
+  }
+
+  canvas.addEventListener('wheel', event => {
+    event.preventDefault();
+    if (event.ctrlKey || event.shiftKey) {
+      const rect = canvas.getBoundingClientRect();
+      const tc = t(event.clientX - rect.left);
+      const factor = Math.exp(Math.sign(event.deltaY || event.deltaX) * 0.15);
+      view = [tc - (tc - view[0]) * factor, tc + (view[1] - tc) * factor];
+    } else {
+      const max = Math.max(0, rows.length - visibleRows());
+      top = Math.min(max, Math.max(0, top + Math.sign(event.deltaY) * 3));
+    }
+    draw();
+  }, {passive: false});
+
+  canvas.addEventListener('mousedown', event => {
+    drag = {x: event.clientX, view: view.slice(), moved: false};
+  });
+
+  window.addEventListener('mouseup', () => {
+    setTimeout(() => { drag = null; }, 0);
+  });
+
+  canvas.addEventListener('mousemove', event => {
+    if (drag !== null && event.buttons === 1) {
+      const dt = (event.clientX - drag.x) / size()[0] * (drag.view[1] - drag.view[0]);
+      drag.moved = drag.moved || Math.abs(event.clientX - drag.x) > 2;
+      view = [drag.view[0] - dt, drag.view[1] - dt];
+      draw();
+      return;
+    }
+    const i = rowAt(event);
+    if (i === null) {
+      tip.style.display = 'none';
+      canvas.style.cursor = 'default';
+      return;
+    }
+    canvas.style.cursor = 'pointer';
+    tip.textContent = `${data.ids[data.dataset[i]]}: ${iso(data.start[i])} to ${iso(data.stop[i])}`;
+    tip.style.left = `${event.clientX + 12}px`;
+    tip.style.top = `${event.clientY + 12}px`;
+    tip.style.display = 'block';
+  });
+
+  canvas.addEventListener('click', event => {
+    if (drag !== null && drag.moved) {
+      return;
+    }
+    const i = rowAt(event);
+    if (i !== null) {
+      window.open(link(event.altKey ? data.links.label : data.links.bar, i), '_blank');
+    }
+  });
+
+  canvas.addEventListener('dblclick', () => {
+    view = [tMin, tMax];
+    draw();
+  });
+
+  document.getElementById('filter').addEventListener('input', event => filter(event.target.value));
+})();
@@ -4,15 +4,12 @@
 import os
 import datetime
 
-import pandas
-
 import utilrsw
-import hapiclient
 
 import hapimeta
 
-cfg = hapimeta.config('availabilities')
-log = hapimeta.logger('availabilities')
+cfg = hapimeta.lazy(hapimeta.config, 'availabilities')
+log = hapimeta.lazy(hapimeta.logger, 'availabilities')
 
 
 def write(fname, data, logger=None):
@@ -26,10 +23,135 @@ def write(fname, data, logger=None):
     raise exc
 
 
+# Characters added to labels by clip().
+special_chars = {
+  'ts': '\u2002', # en space
+  'rarrow': '\u2192 ',
+  'larrow': '\u2190'
+}
+
+
+def clip(datasets, starts, stops):
+  """
+  Clip stops to clip_date() and starts to 1960-01-01.
+
+  Returns new lists (labels, starts, stops, start_text). Labels of datasets
+  with a clipped stop start with a right arrow; start_text is a left arrow for
+  datasets with a clipped start and None otherwise.
+  """
+  stops_max = clip_date()
+  starts_min = datetime.datetime(1960, 1, 1, 0, 0, 0)
+
+  labels = []
+  starts_clipped = []
+  stops_clipped = []
+  start_text = []
+  for ds in range(len(datasets)):
+    label = f"{special_chars['ts']}{datasets[ds]}"
+    if stops[ds] > stops_max:
+      stops_clipped.append(stops_max)
+      label = f"{special_chars['rarrow']}{label}"
+    else:
+      stops_clipped.append(stops[ds])
+    if starts[ds] < starts_min:
+      starts_clipped.append(starts_min)
+      start_text.append(special_chars['larrow'])
+    else:
+      starts_clipped.append(starts[ds])
+      start_text.append(None)
+    labels.append(label)
+
+  return labels, starts_clipped, stops_clipped, start_text
+
+
+def clip_date():
+  """
+  Return the first day of the month five years from now.
+
+  Stops after this are clipped to it. It only changes once a month, so
+  plots of servers with such stops do not change (see fingerprint()) on
+  every run.
+  """
+  now = datetime.datetime.now()
+  return datetime.datetime(now.year + 5, now.month, 1)
+
+
+def fingerprint(title, ids, starts, stops):
+  """
+  Return a hash of everything that determines a server's plots and HTML:
+  the plotted datasets and their time ranges, the title (server, URL, and
+  number of datasets), the config that affects rendering, the HTML template,
+  and, if a stop is clipped, clip_date(). Nothing that changes on every run
+  of catalogs (e.g., x_LastUpdate) may be in the title.
+  """
+  import json
+  import hashlib
+
+  template = os.path.join(os.path.dirname(__file__), 'availabilities.html')
+  with open(template, 'rb') as f:
+    template_hash = hashlib.sha256(f.read()).hexdigest()
+
+  # Keys that do not affect the plots or HTML.
+  omit = ('workers', 'cache', 'intervals', 'parquet')
+  render_cfg = {key: value for key, value in cfg.items() if key not in omit}
+  clipped = len(stops) > 0 and max(stops) > clip_date()
+  content = {
+    'version': hapimeta.__version__,
+    'title': title,
+    'ids': ids,
+    'starts': [start.isoformat() for start in starts],
+    'stops': [stop.isoformat() for stop in stops],
+    'cfg': render_cfg,
+    'template': template_hash,
+    'clip_date': clip_date().isoformat() if clipped else None
+  }
+  content = json.dumps(content, sort_keys=True, default=str)
+  return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def cached(server, server_dir, fingerprint_):
+  """
+  Return True if the plots and HTML in server_dir were made from data with
+  fingerprint_ and all of them exist.
+  """
+  import json
+
+  server_file = os.path.basename(server)
+  fname = os.path.join(server_dir, f'{server_file}.fingerprint.json')
+  if not os.path.exists(fname):
+    return False
+  try:
+    with open(fname) as f:
+      last = json.load(f)
+  except Exception as exc:
+    log.warning(f'Could not read {fname}: {exc}')
+    return False
+
+  if last.get('fingerprint') != fingerprint_:
+    return False
+
+  for fmt in cfg['savefig_fmts']:
+    fnames = [f'{file}.{fmt}' for file in last['files']]
+    fnames += [f'{server_file}.json', f'{server}.html']
+    for fname in fnames:
+      if not os.path.exists(os.path.join(server_dir, fmt, fname)):
+        return False
+
+  return True
+
+
+def id_strip(id):
+  for key, value in special_chars.items():
+    id = id.strip().replace(value, '')
+  return id
+
+
 def plot(server, server_url, server_dir, title, datasets, starts, stops,
          lines_per_plot=None,
-         fig_width=None, fig_height=None):
+         fig_width=None, fig_height=None, fmts=None):
 
+  if fmts is None:
+    fmts = cfg['savefig_fmts']
   if lines_per_plot is None:
     lines_per_plot = cfg['lines_per_plot']
   if fig_width is None:
@@ -43,20 +165,8 @@ def plot(server, server_url, server_dir, title, datasets, starts, stops,
   plt.rcParams['svg.fonttype'] = 'none'
   plt.rcParams['font.family'] = ['Times New Roman', 'DejaVu Sans']
 
-  special_chars = {
-    'ts': '\u2002', # en space
-    'rarrow': '\u2192 ',
-    'larrow': '\u2190'
-  }
   server_file = os.path.basename(server)
 
-  def newfig(height=None):
-    plt.close('all')
-    fig, ax = plt.subplots()
-    fig.set_figheight(fig_height if height is None else height)
-    fig.set_figwidth(fig_width)
-    return fig, ax
-
   def ax_config(ax, starts_min, stops_max, title=None, fixed_rows=False):
 
     import datetick
@@ -77,145 +187,330 @@ def plot(server, server_url, server_dir, title, datasets, starts, stops,
 
     datetick.datetick('x', axes=ax)
 
-  def id_strip(id):
-    for key, value in special_chars.items():
-      id = id.strip().replace(value, '')
-    return id
-
-  def savefig(fn):
+  def savefig(fig, fn):
 
-    if 'svg' in cfg['savefig_fmts']:
+    if 'svg' in fmts:
       _fname = os.path.join(server_dir, 'svg', f'{server_file}.{fn}.svg')
       if not os.path.exists(os.path.dirname(_fname)):
         os.makedirs(os.path.dirname(_fname))
       log.info(f'Writing {_fname}')
-      plt.savefig(f'{_fname}', bbox_inches='tight', pad_inches=0)
+      fig.savefig(f'{_fname}', bbox_inches='tight', pad_inches=0)
       utilrsw.svg.svglinks(_fname, link_attribs={'target': '_blank'}, debug=cfg['debug_svglinks'])
 
-    if 'png' in cfg['savefig_fmts']:
+    if 'png' in fmts:
       _fname = os.path.join(server_dir, 'png', f'{server_file}.{fn}.png')
       if not os.path.exists(os.path.dirname(_fname)):
         os.makedirs(os.path.dirname(_fname))
       log.info(f'Writing {_fname}')
-      plt.savefig(f'{_fname}', dpi=cfg['dpi'], bbox_inches='tight', pad_inches=0)
+      fig.savefig(f'{_fname}', dpi=cfg['dpi'], bbox_inches='tight', pad_inches=0)
 
     return f'{server_file}.{fn}'
 
-  def draw(ax, n, lines_per_plot, starts, stops, datasets,
-           start_text, max_len=None, row_n=None):
-    base = "https://hapi-server.org"
-    gid_bar = f'{base}/servers/#server={server}&dataset={id_strip(datasets[n])}'
-    gid_txt = f'{base}/plot/?server={server_url}&dataset={id_strip(datasets[n])}&format=gallery&usecache=true&usedatacache=true&mode=thumb'
-
-    if row_n is None:
-      row_n = n
-    y = lines_per_plot - row_n
-    ax.plot([starts[n], stops[n]], [y, y], gid=gid_bar, linewidth=0.5)
+  def draw(ax, page, lines_per_plot, starts, stops, datasets, start_text):
+    """
+    Draw the bars for the datasets with indices in page as a single
+    PolyCollection and their labels as text artists.
+    """
+    from matplotlib.dates import date2num
+    from matplotlib.collections import PolyCollection
 
+    base = "https://hapi-server.org"
     colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
-    color = colors[n % len(colors)]
-    kwargs = {
-      "color": color,
-      "alpha": 1,
-      "gid": gid_bar
-    }
     height = 0.8
-    xy = (starts[n], y - height/2)
-    width = stops[n] - starts[n]
-    rect = plt.Rectangle(xy, width, height, **kwargs)
-    rect.set_linewidth(0)
-    ax.add_patch(rect)
 
-    if max_len is None:
+    verts = []
+    facecolors = []
+    urls = []
+    for row_n, n in enumerate(page):
+      y = lines_per_plot - row_n
+      x0 = date2num(starts[n])
+      x1 = date2num(stops[n])
+      verts.append([(x0, y - height/2), (x0, y + height/2), (x1, y + height/2), (x1, y - height/2)])
+      facecolors.append(colors[n % len(colors)])
+      urls.append(f'{base}/servers/#server={server}&dataset={id_strip(datasets[n])}')
+
+    # The edge gives bars for datasets with short time ranges a minimum
+    # width, as the line drawn under each bar did previously.
+    bars = PolyCollection(verts, facecolors=facecolors, edgecolors=facecolors, linewidths=0.5)
+    # Matplotlib writes each bar in an <a xlink:href=url target="_blank">
+    # element, so svglinks only needs to add links for the labels.
+    bars.set_urls(urls)
+    ax.add_collection(bars)
+    ax.xaxis_date()
+    ax.autoscale_view()
+
+    for row_n, n in enumerate(page):
+      y = lines_per_plot - row_n
+      gid_txt = f'{base}/plot/?server={server_url}&dataset={id_strip(datasets[n])}&format=gallery&usecache=true&usedatacache=true&mode=thumb'
+
+      text_kwargs = {
+        'color': facecolors[row_n],
+        'verticalalignment': 'center',
+        'size': 8,
+        'gid': gid_txt,
+        'bbox': dict(facecolor='white', alpha=0.5, pad=0, lw=0)
+      }
       label = datasets[n].rstrip()
-    else:
-      label = f'{datasets[n]:{max_len}s}'
-
-    text_kwargs = {
-      'color': color,
-      'verticalalignment': 'center',
-      'size': 8,
-      'gid': gid_txt,
-      'bbox': dict(facecolor='white', alpha=0.5, pad=0, lw=0)
-    }
-    if stops[n] <= min(starts):
-      ax.text(min(starts), y, label, **text_kwargs)
-    else:
-      ax.text(stops[n], y, label, **text_kwargs)
+      if stops[n] <= starts_min:
+        ax.text(starts_min, y, label, **text_kwargs)
+      else:
+        ax.text(stops[n], y, label, **text_kwargs)
 
-    if start_text[n] is not None:
-      text_kwargs['horizontalalignment'] = 'right'
-      ax.text(starts[n], y, start_text[n], **text_kwargs)
+      if start_text[n] is not None:
+        text_kwargs['horizontalalignment'] = 'right'
+        ax.text(starts[n], y, start_text[n], **text_kwargs)
 
   n_plots = math.ceil(len(datasets)/lines_per_plot)
   pad = max(1, math.ceil(math.log10(n_plots + 1)))
 
-  stops_max = datetime.datetime.now() + datetime.timedelta(days=5*365)
-  starts_min = datetime.datetime(1960, 1, 1, 0, 0, 0)
+  datasets, starts, stops, start_text = clip(datasets, starts, stops)
+  starts_min = min(starts)
+  stops_max = max(stops)
 
-  max_len = 0
-  start_text = []
-  for ds in range(len(datasets)):
-    datasets[ds] = f"{special_chars['ts']}{datasets[ds]}"
-    if stops[ds] > stops_max:
-      stops[ds] = stops_max
-      datasets[ds] = f"{special_chars['rarrow']}{datasets[ds]}"
-    if starts[ds] < starts_min:
-      starts[ds] = starts_min
-      start_text.append(special_chars['larrow'])
-    else:
-      start_text.append(None)
-    max_len = max(max_len, len(datasets[ds]))
+  # One figure is used for all pages; only its height and the content of its
+  # axes change between pages.
+  plt.close('all')
+  fig, ax = plt.subplots()
+  fig.set_figwidth(fig_width)
+
+  files = []
+  for fn in range(1, n_plots + 1):
+    page = range((fn - 1)*lines_per_plot, min(fn*lines_per_plot, len(datasets)))
+
+    height = fig_height
+    if fn == 1 and len(datasets) < lines_per_plot:
+      # Delta is expected hight of title and x-axis labels
+      # Ideally we would compute exact value.
+      delta = 0.5
+      height = delta + (fig_height * len(datasets)/ lines_per_plot)
+    elif len(page) < lines_per_plot:
+      height *= len(page) / lines_per_plot
+    fig.set_figheight(height)
+
+    ax.cla()
+    draw(ax, page, lines_per_plot, starts, stops, datasets, start_text)
+
+    fn_padded = f'{fn:0{pad}d}'
+    title_ = title + f' | {fn}/{n_plots}'
+    ax_config(ax, starts_min, stops_max, title_, fixed_rows=len(page) == lines_per_plot)
+    file = savefig(fig, fn_padded)
+    files.append(file)
+
+  plt.close(fig)
+
+  return files
+
+
+def plot_svg(server, server_url, server_dir, title, datasets, starts, stops,
+             lines_per_plot=None, fig_width=None, fig_height=None):
+  """
+  Write the SVG pages of plot() without matplotlib.
+
+  Bars, labels, links, and the time axis are written directly as SVG
+  elements, so no svglinks pass is needed. Dimensions are in points, as in
+  matplotlib's SVG output. Returns the same list of file names as plot().
+  """
+  import math
+  from xml.sax.saxutils import escape, quoteattr
+
+  if lines_per_plot is None:
+    lines_per_plot = cfg['lines_per_plot']
+  if fig_width is None:
+    fig_width = cfg['fig_width_pixels']/cfg['dpi']
+  if fig_height is None:
+    fig_height = cfg['fig_height_pixels']/cfg['dpi']
+
+  server_file = os.path.basename(server)
+  base = "https://hapi-server.org"
 
+  # matplotlib's default color cycle, which plot() uses.
+  colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd',
+            '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
+  font_size = 8
+  char_width = 0.5*font_size  # Approximate; used only to size the canvas.
+  title_height = 20
+  axis_height = 24
+
+  datasets, starts, stops, start_text = clip(datasets, starts, stops)
   starts_min = min(starts)
   stops_max = max(stops)
 
+  width = 72*fig_width
+  row_height = (72*fig_height - title_height - axis_height)/lines_per_plot
+  span = (stops_max - starts_min).total_seconds() or 1.0
+
+  def x(t):
+    return round(width*(t - starts_min).total_seconds()/span, 2)
+
+  majors, minors = time_ticks(starts_min, stops_max)
+
+  # Attributes shared by many elements. Selectors are scoped to the class of
+  # the svg element because the pages are inlined in one HTML file.
+  style = '\n'.join([
+    '<style>',
+    '.availabilities text {font-family: "Times New Roman", "DejaVu Sans", serif; font-size: 10px}',
+    f'.availabilities .label {{font-size: {font_size}px; dominant-baseline: central; '
+    'stroke: #fff; stroke-opacity: 0.5; stroke-width: 2px; paint-order: stroke}',
+    '.availabilities .start {text-anchor: end}',
+    '.availabilities .tick, .availabilities .title {text-anchor: middle}',
+    '.availabilities line {stroke-width: 0.8px}',
+    '.availabilities .minor {stroke: #b0b0b0; stroke-opacity: 0.5; stroke-dasharray: 1,1.65}',
+    '.availabilities .major {stroke: #000; stroke-opacity: 0.5}',
+    '.availabilities .spine {stroke: #000}',
+    '</style>'
+  ])
+
+  def axis(y0, y1):
+    els = []
+    for t in minors:
+      els.append(f'<line class="minor" x1="{x(t)}" y1="{y0}" x2="{x(t)}" y2="{y1}"/>')
+    for t, label in majors:
+      els.append(f'<line class="major" x1="{x(t)}" y1="{y0}" x2="{x(t)}" y2="{y1}"/>')
+      els.append(f'<text class="tick" x="{x(t)}" y="{y1 + 12}">{escape(label)}</text>')
+    els.append(f'<line class="spine" x1="{width}" y1="{y0}" x2="{width}" y2="{y1}"/>')
+    return els
+
+  def page_svg(page, fn, n_plots):
+    n_rows = lines_per_plot if len(page) == lines_per_plot else len(page)
+    y0 = title_height
+    y1 = title_height + round(row_height*n_rows, 2)
+
+    els = axis(y0, y1)
+    x_min = 0
+    x_max = width
+    for row_n, n in enumerate(page):
+      color = colors[n % len(colors)]
+      y = round(y0 + row_height*(row_n + 0.5), 2)
+      bar_height = round(0.8*row_height, 2)
+      x_start = x(starts[n])
+      x_stop = x(stops[n])
+      dataset = id_strip(datasets[n])
+
+      href = f'{base}/servers/#server={server}&dataset={dataset}'
+      bar = f'<rect x="{x_start}" y="{round(y - bar_height/2, 2)}" width="{max(0.5, round(x_stop - x_start, 2))}" height="{bar_height}" fill="{color}"/>'
+      els.append(f'<a href={quoteattr(href)} target="_blank">{bar}</a>')
 
-  height = fig_height
-  if len(datasets) < lines_per_plot:
-    # Delta is expected hight of title and x-axis labels
-    # Ideally we would compute exact value.
-    delta = 0.5
-    height = delta + (fig_height * len(datasets)/ lines_per_plot)
-  fig, ax = newfig(height=height)
+      label = datasets[n].rstrip()
+      x_label = x_stop if stops[n] > starts_min else 0
+      href = f'{base}/plot/?server={server_url}&dataset={dataset}&format=gallery&usecache=true&usedatacache=true&mode=thumb'
+      text = f'<text class="label" x="{x_label}" y="{y}" fill="{color}">{escape(label)}</text>'
+      els.append(f'<a href={quoteattr(href)} target="_blank">{text}</a>')
+      x_max = max(x_max, x_label + char_width*len(label))
+
+      if start_text[n] is not None:
+        text = f'<text class="label start" x="{x_start}" y="{y}" fill="{color}">{escape(start_text[n])}</text>'
+        els.append(f'<a href={quoteattr(href)} target="_blank">{text}</a>')
+        x_min = min(x_min, x_start - char_width*len(start_text[n]))
+
+    title_ = f'{title} | {fn}/{n_plots}'
+    els.append(f'<text class="title" x="{width/2}" y="{title_height - 6}">{escape(title_)}</text>')
+
+    x_min = math.floor(x_min)
+    svg_width = math.ceil(x_max - x_min)
+    svg_height = math.ceil(y1 + axis_height)
+    head = (f'<svg xmlns="http://www.w3.org/2000/svg" class="availabilities" width="{svg_width}pt" '
+            f'height="{svg_height}pt" viewBox="{x_min} 0 {svg_width} {svg_height}">')
+    background = f'<rect x="{x_min}" y="0" width="{svg_width}" height="{svg_height}" fill="#fff"/>'
+    return '\n'.join([head, style, background, *els, '</svg>\n'])
+
+  n_plots = math.ceil(len(datasets)/lines_per_plot)
+  pad = max(1, math.ceil(math.log10(n_plots + 1)))
 
-  fn = 0
   files = []
-  row_n = 0
-  for n in range(len(datasets)):
-    draw(ax, n, lines_per_plot, starts, stops, datasets, start_text, row_n=row_n)
-    row_n += 1
-    if (n + 1) % lines_per_plot == 0:
-      fn = fn + 1
-      fn_padded = f'{fn:0{pad}d}'
-      title_ = title + f' | {fn}/{n_plots}'
-      ax_config(ax, starts_min, stops_max, title_, fixed_rows=True)
-      file = savefig(fn_padded)
-      files.append(file)
-
-      remaining_lines = len(datasets) - (n + 1)
-      if remaining_lines > 0:
-        height = fig_height
-        if remaining_lines < lines_per_plot:
-          height *= remaining_lines / lines_per_plot
-        fig, ax = newfig(height=height)
-        row_n = 0
-
-  if (n + 1) % lines_per_plot != 0:
-    fn = fn + 1
+  for fn in range(1, n_plots + 1):
+    page = range((fn - 1)*lines_per_plot, min(fn*lines_per_plot, len(datasets)))
     fn_padded = f'{fn:0{pad}d}'
-    title_ = title + f' | {fn}/{n_plots}'
-    ax_config(ax, starts_min, stops_max, title_, fixed_rows=False)
-    file = savefig(fn_padded)
-    files.append(file)
+    fname = os.path.join(server_dir, 'svg', f'{server_file}.{fn_padded}.svg')
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    log.info(f'Writing {fname}')
+    with open(fname, 'w', encoding='utf-8') as f:
+      f.write(page_svg(page, fn, n_plots))
+    files.append(f'{server_file}.{fn_padded}')
 
   return files
 
 
-def html(files, server_dir, server):
+def time_ticks(start, stop, max_ticks=12):
+  """
+  Return (majors, minors) for a time axis from start to stop, where majors is
+  a list of (datetime, label) and minors a list of datetimes.
+
+  The major step is the smallest in steps that gives at most max_ticks ticks;
+  the minor step is the next smaller step. Labels use the precision of the
+  step (year, month, day, or hour), as datetick does.
+  """
+  steps = [
+    ('hours', 1), ('hours', 3), ('hours', 6), ('hours', 12),
+    ('days', 1), ('days', 2), ('days', 5), ('days', 10),
+    ('months', 1), ('months', 3), ('months', 6),
+    ('years', 1), ('years', 2), ('years', 5), ('years', 10),
+    ('years', 20), ('years', 50), ('years', 100)
+  ]
+  formats = {'hours': '%Y-%m-%dT%H', 'days': '%Y-%m-%d', 'months': '%Y-%m', 'years': '%Y'}
+
+  def floor(t, unit, n):
+    if unit == 'years':
+      return datetime.datetime(t.year - t.year % n, 1, 1)
+    if unit in ('months', 'days'):
+      return datetime.datetime(t.year, t.month - (t.month - 1) % (n if unit == 'months' else 1), 1)
+    return datetime.datetime(t.year, t.month, t.day)
+
+  def add(t, unit, n):
+    if unit == 'years':
+      return t.replace(year=t.year + n)
+    if unit == 'months':
+      month = t.month - 1 + n
+      return t.replace(year=t.year + month // 12, month=month % 12 + 1)
+    return t + datetime.timedelta(**{unit: n})
+
+  def ticks(unit, n):
+    out = []
+    t = floor(start, unit, n)
+    while t <= stop:
+      if unit == 'days':
+        # Days 1, 1 + n, ... (up to the 28th if n > 1) of each month, so
+        # ticks align with months.
+        next_month = add(t, 'months', 1)
+        n_days = (next_month - t).days if n == 1 else 28
+        days = [t + datetime.timedelta(days=d) for d in range(0, n_days, n)]
+        out.extend(day for day in days if start <= day <= stop)
+        t = next_month
+      else:
+        if t >= start:
+          out.append(t)
+        t = add(t, unit, n)
+    return out
+
+  seconds = {'hours': 3600, 'days': 86400, 'months': 30.44*86400, 'years': 365.25*86400}
+  span = (stop - start).total_seconds()
+
+  i_major = len(steps) - 1
+  for i, (unit, n) in enumerate(steps):
+    # Skip steps that give far too many ticks without generating them.
+    if span/(n*seconds[unit]) > 2*max_ticks:
+      continue
+    if len(ticks(unit, n)) <= max_ticks:
+      i_major = i
+      break
+
+  unit, n = steps[i_major]
+  majors = [(t, t.strftime(formats[unit])) for t in ticks(unit, n)]
+  minors = []
+  if i_major > 0:
+    major_times = set(t for t, _ in majors)
+    minors = [t for t in ticks(*steps[i_major - 1]) if t not in major_times]
+
+  return majors, minors
+
+
+def html(files, server_dir, server, ids=None):
   import base64
   from string import Template
 
+  if cfg.get('html', 'inline') == 'lazy' and ids is not None:
+    html_lazy(files, server_dir, server, ids)
+    return
+
   server_file = os.path.basename(server)
 
   # Read HTML template from external file
@@ -264,7 +559,113 @@ def html(files, server_dir, server):
     write(fname, html_content_png)
 
 
+def html_lazy(files, server_dir, server, ids):
+  """
+  Write HTML pages that reference the plot files instead of inlining them.
+
+  Pages are <img loading="lazy"> elements, so the browser only requests
+  those scrolled into view. The PNG page shows thumbnails (made from the
+  full-size PNGs) that link to the full-size files; the SVG page shows the
+  SVGs, which link to themselves so that their bar and label links can be
+  followed. A search box uses an index of dataset ID to page, which is also
+  written to SERVER.index.json in each format directory.
+  """
+  import json
+  from html import escape
+  from string import Template
+
+  server_file = os.path.basename(server)
+  lines_per_plot = cfg['lines_per_plot']
+
+  html_template_path = os.path.join(os.path.dirname(__file__), 'availabilities.html')
+  with open(html_template_path, 'r', encoding='utf-8') as f:
+    template = Template(f.read())
+
+  index = {'pages': [], 'datasets': {}}
+  for n, file in enumerate(files):
+    page_ids = ids[n*lines_per_plot:(n + 1)*lines_per_plot]
+    index['pages'].append({'file': file, 'first': page_ids[0], 'last': page_ids[-1]})
+    for id in page_ids:
+      index['datasets'][id] = n + 1
+
+  index_js = json.dumps(index).replace('</', '<\\/')
+  search = f"""
+<div id="dataset-search" style="margin: 0.5em 0;">
+  <b>Search:</b> <input id="dataset-search-input" list="dataset-ids" size="40" placeholder="Dataset ID">
+  <span id="dataset-search-result"></span>
+  <datalist id="dataset-ids"></datalist>
+  Click a page to open it at full size; in SVG pages, click a dataset name or bar to view information about or plots of the dataset.
+</div>
+<script>
+  const index = {index_js};
+  const list = document.getElementById('dataset-ids');
+  for (const id of Object.keys(index.datasets)) {{
+    const option = document.createElement('option');
+    option.value = id;
+    list.appendChild(option);
+  }}
+  document.getElementById('dataset-search-input').addEventListener('change', function () {{
+    const query = this.value.trim().toLowerCase();
+    let id = Object.keys(index.datasets).find(id => id.toLowerCase() === query);
+    if (id === undefined) {{
+      id = Object.keys(index.datasets).find(id => id.toLowerCase().includes(query));
+    }}
+    const result = document.getElementById('dataset-search-result');
+    if (query === '' || id === undefined) {{
+      result.textContent = query === '' ? '' : 'Not found';
+      return;
+    }}
+    const page = index.datasets[id];
+    result.textContent = `${{id}} is on page ${{page}}/${{index.pages.length}}`;
+    document.getElementById(`page-${{page}}`).scrollIntoView();
+  }});
+</script>
+"""
+
+  for fmt in cfg['savefig_fmts']:
+    fmt_dir = os.path.join(server_dir, fmt)
+    if fmt == 'png' and cfg.get('thumbnail_width_pixels') is not None:
+      thumbnails(files, fmt_dir, cfg['thumbnail_width_pixels'])
+
+    divs = search
+    for n, file in enumerate(files):
+      page = index['pages'][n]
+      src = f'{file}.{fmt}'
+      if fmt == 'png' and cfg.get('thumbnail_width_pixels') is not None:
+        src = f'thumbs/{file}.{fmt}'
+      divs += f'<div id="page-{n + 1}">\n'
+      divs += f'  <div>Page {n + 1}/{len(files)}: {escape(page["first"])} &ndash; {escape(page["last"])}</div>\n'
+      divs += f'  <a href="{escape(file)}.{fmt}" target="_blank">'
+      divs += f'<img loading="lazy" width="100%" src="{escape(src)}" alt="{escape(file)}"></a>\n'
+      divs += '</div>\n'
+
+    html_content = template.substitute(
+      title=server,
+      server_id=server,
+      server_file=server_file,
+      search_note_display='none',
+      divs=divs
+    )
+    write(os.path.join(fmt_dir, f'{server_file}.index.json'), index)
+    write(os.path.join(fmt_dir, f'{server}.html'), html_content)
+
+
+def thumbnails(files, png_dir, width):
+  """Write copies of the PNGs in png_dir, scaled to width, in png_dir/thumbs."""
+  from PIL import Image
+
+  os.makedirs(os.path.join(png_dir, 'thumbs'), exist_ok=True)
+  for file in files:
+    fname = os.path.join(png_dir, f'{file}.png')
+    fname_thumb = os.path.join(png_dir, 'thumbs', f'{file}.png')
+    with Image.open(fname) as image:
+      height = max(1, round(image.height*width/image.width))
+      log.info(f'Writing {fname_thumb}')
+      image.resize((width, height), Image.LANCZOS).save(fname_thumb, optimize=True)
+
+
 def process_server(server, catalog_all, max_datasets=None):
+  import pandas
 
   def extract_time(info, key):
     if key not in info:
@@ -281,12 +682,12 @@ def process_server(server, catalog_all, max_datasets=None):
 
     hapitime = info[key]
     try:
-      dt = hapiclient.hapitime2datetime(hapitime, allow_missing_Z=True)
-      dt = dt[0].replace(tzinfo=None)
+      dt = hapimeta.hapitime.parse(hapitime, allow_missing_Z=True)
+      dt = dt.replace(tzinfo=None)
     except Exception:
       import traceback
       trace = traceback.format_exc()
-      msg = f'hapitime2datetime({hapitime}) returned:\n{trace}'
+      msg = f'hapimeta.hapitime.parse({hapitime}) returned:\n{trace}'
       hapimeta.error.store(server, dataset['id'], msg, log)
       return None, None
 
@@ -306,6 +707,16 @@ def process_server(server, catalog_all, max_datasets=None):
     datasets = datasets[:max_datasets]
 
   log.info(f'{server}: {len(datasets)} datasets')
+
+  # Parse all times with one call per time format; extract_time() then gets
+  # them from the cache.
+  times = []
+  for dataset in datasets:
+    if isinstance(dataset.get('info'), dict):
+      times.append(dataset['info'].get('startDate'))
+      times.append(dataset['info'].get('stopDate'))
+  hapimeta.hapitime.parse_batch(times, allow_missing_Z=True)
+
   for dataset in datasets:
 
     if 'id' not in dataset:
@@ -343,45 +754,259 @@ def process_server(server, catalog_all, max_datasets=None):
     log.info(f'{server}: No datasets with valid startDate and stopDate found in catalog')
     return df
 
-  log.info('Plotting availabilities')
-
+  # The title of the plots only has content that is in the fingerprint. The
+  # time of the last /catalog request (x_LastUpdate) changes on every run of
+  # catalogs, so it is only in the title of the intervals file, which is
+  # written on every run.
   server_url = catalog_all['about']['x_url']
-  x_LastUpdate = catalog_all['catalog'].get('x_LastUpdate', '')
-  title = f'{server} | {server_url} | {len(ids)} datasets | {x_LastUpdate}'
+  title = f'{server} | {server_url} | {len(ids)} datasets'
+
+  if cfg.get('intervals', False):
+    import json
+    x_LastUpdate = catalog_all['catalog'].get('x_LastUpdate', '')
+    title_ = f'{title} | {x_LastUpdate}'
+    fname = os.path.join(server_dir, f'{server_file}.intervals.json')
+    log.info(f'Writing {fname}')
+    with open(fname, 'w', encoding='utf-8') as f:
+      json.dump(intervals(server, server_url, title_, ids, starts, stops), f, separators=(',', ':'))
+
+  log.info('Plotting availabilities')
 
   if cfg['max_datasets'] is not None and len(ids) > cfg['max_datasets']:
     ids = ids[:cfg['max_datasets']]
     starts = starts[:cfg['max_datasets']]
     stops = stops[:cfg['max_datasets']]
 
-  files = plot(server, server_url, server_dir, title, ids, starts, stops,
-               lines_per_plot=cfg['lines_per_plot'],
-               fig_width=cfg['fig_width_pixels']/cfg['dpi'],
-               fig_height=cfg['fig_height_pixels']/cfg['dpi'])
+  fingerprint_ = fingerprint(title, ids, starts, stops)
+  if cfg.get('cache', True) and cached(server, server_dir, fingerprint_):
+    log.info(f'{server}: Plots are up-to-date; not re-rendering')
+    return df
+
+  kwargs = {
+    'lines_per_plot': cfg['lines_per_plot'],
+    'fig_width': cfg['fig_width_pixels']/cfg['dpi'],
+    'fig_height': cfg['fig_height_pixels']/cfg['dpi']
+  }
+  if cfg.get('renderer', 'matplotlib') == 'svg' and 'svg' in cfg['savefig_fmts']:
+    # SVGs are written directly; matplotlib is only used for PNGs.
+    files = plot_svg(server, server_url, server_dir, title, ids, starts, stops, **kwargs)
+    if 'png' in cfg['savefig_fmts']:
+      plot(server, server_url, server_dir, title, ids, starts, stops, fmts=['png'], **kwargs)
+  else:
+    files = plot(server, server_url, server_dir, title, ids, starts, stops, **kwargs)
 
   for savefig_fmt in cfg['savefig_fmts']:
     fname = os.path.join(server_dir, savefig_fmt, f'{server_file}.json')
     log.info(f'Writing {fname}')
     write(fname, files)
 
-  html(files, server_dir, server)
+  html(files, server_dir, server, ids=ids)
+
+  # Written last so that an interrupted run does not leave a fingerprint for
+  # incomplete outputs.
+  fname = os.path.join(server_dir, f'{server_file}.fingerprint.json')
+  write(fname, {'fingerprint': fingerprint_, 'files': files})
 
   return df
 
 
-def run():
+def intervals(server, server_url, title, ids, starts, stops):
+  """
+  Return the content of SERVER.intervals.json, which availabilities-viewer.js
+  draws. Its form is
+    {
+      'server': str, 'url': str, 'title': str,
+      'links': {'bar': str, 'label': str},
+      'ids': [str, ...],
+      'dataset': [int, ...], 'start': [int, ...], 'stop': [int, ...]
+    }
+  Interval i is for dataset ids[dataset[i]] and starts and stops at the
+  given seconds since 1970-01-01T00:00:00Z. In the link templates, {server},
+  {server_url}, and {dataset} are replaced with the server ID, server URL,
+  and (URL encoded) dataset ID.
+  """
+  epoch = datetime.datetime(1970, 1, 1)
+  index = {}
+  for id in ids:
+    index.setdefault(id, len(index))
+
+  base = "https://hapi-server.org"
+  return {
+    'server': server,
+    'url': server_url,
+    'title': title,
+    'links': {
+      'bar': base + '/servers/#server={server}&dataset={dataset}',
+      'label': base + '/plot/?server={server_url}&dataset={dataset}&format=gallery&usecache=true&usedatacache=true&mode=thumb'
+    },
+    'ids': list(index.keys()),
+    'dataset': [index[id] for id in ids],
+    'start': [int((start - epoch).total_seconds()) for start in starts],
+    'stop': [int((stop - epoch).total_seconds()) for stop in stops]
+  }
 
-  log.info('Generating availability plots')
-  args = hapimeta.cli()
-  all = hapimeta.all(log)
 
-  dfs = []
-  for server in all.keys():
-    df = process_server(server, all[server], max_datasets=args.n_datasets)
+def process_server_worker(server, catalog_all, max_datasets=None):
+  """
+  Run process_server() in a worker process and write its errors.
+
+  Errors are stored in the worker's copy of hapimeta.error.store, so they are
+  written by the worker.
+  """
+  import matplotlib
+  matplotlib.use('Agg')
+
+  try:
+    return process_server(server, catalog_all, max_datasets=max_datasets)
+  finally:
     hapimeta.error.write(server, 'availabilities', log)
-    dfs.append(df)
 
-  dfs = pandas.concat([d for d in dfs if d is not None], ignore_index=True)
+
+def run_workers(all, max_datasets, workers, on_result=None):
+  """
+  Process servers in a pool of worker processes. Returns {server: df}.
+
+  If given, on_result(server, df) is called as each server's result comes
+  back, in the order in which the workers finish.
+
+  Servers with the most datasets are submitted first so that they do not
+  start last and leave the other workers idle.
+  """
+  import concurrent.futures
+
+  def n_datasets(server):
+    datasets = utilrsw.get_path(all[server], 'catalog/catalog', sep='/')
+    return 0 if datasets is None else len(datasets)
+
+  servers = sorted(all.keys(), key=n_datasets, reverse=True)
+  log.info(f'Processing {len(servers)} servers using {workers} worker processes')
+
+  dfs = {}
+  with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+    futures = {}
+    for server in servers:
+      future = pool.submit(process_server_worker, server, all[server], max_datasets)
+      futures[future] = server
+    for future in concurrent.futures.as_completed(futures):
+      server = futures[future]
+      try:
+        dfs[server] = future.result()
+      except Exception as exc:
+        log.error(f'{server}: Uncaught exception in worker: {exc}')
+        dfs[server] = None
+      if on_result is not None:
+        on_result(server, dfs[server])
+
+  return dfs
+
+
+class ParquetWriter:
+  """
+  Write the DataFrames returned by process_server() to a Parquet file with
+  one row group per server, as each server is processed.
+
+  The server column is dictionary-encoded and start and stop are
+  timestamp[ns, UTC] (read by pandas as datetime64[ns, UTC]); times outside
+  of the range of timestamp[ns] (1677-09-21 to 2262-04-11) are null.
+
+  Requires pyarrow (pip install -e .[parquet]). If it is not installed, a
+  warning is logged and nothing is written.
+  """
+
+  def __init__(self, fname):
+    self.fname = fname
+    self.writer = None
+    try:
+      import pyarrow
+      import pyarrow.parquet
+    except ImportError:
+      log.warning(f'pyarrow is not installed; not writing {fname}. Use pip install -e .[parquet]')
+      return
+
+    self.schema = pyarrow.schema([
+      ('server', pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+      ('dataset', pyarrow.string()),
+      ('start', pyarrow.timestamp('ns', tz='UTC')),
+      ('stop', pyarrow.timestamp('ns', tz='UTC'))
+    ])
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    # Written to a temporary file that replaces fname when closed, so readers
+    # never see a partial file.
+    self.writer = pyarrow.parquet.ParquetWriter(f'{fname}.tmp', self.schema)
+
+  def write(self, server, df):
+    if self.writer is None or df is None or len(df) == 0:
+      return
+
+    import pyarrow
+
+    def timestamps(times):
+      lo = datetime.datetime(1677, 9, 22)
+      hi = datetime.datetime(2262, 4, 11)
+      times = [time if lo <= time <= hi else None for time in times]
+      return pyarrow.array(times, type=pyarrow.timestamp('ns', tz='UTC'))
+
+    server = pyarrow.array(df['server'].tolist(), type=pyarrow.string()).dictionary_encode()
+    table = pyarrow.Table.from_arrays([
+      server.cast(self.schema.field('server').type),
+      pyarrow.array(df['dataset'].tolist(), type=pyarrow.string()),
+      timestamps(df['start'].tolist()),
+      timestamps(df['stop'].tolist())
+    ], schema=self.schema)
+    self.writer.write_table(table)
+
+  def close(self):
+    if self.writer is None:
+      return
+    self.writer.close()
+    log.info(f'Writing {self.fname}')
+    os.replace(f'{self.fname}.tmp', self.fname)
+
+
+def run():
+  import pandas
+
+  log.info('Generating availability plots')
+  args = hapimeta.cli()
+  # process_server() does not modify the catalog, so share it with other
+  # generators run in the same process instead of unpickling a copy.
+  all = hapimeta.all(log, readonly=True)
+
+  workers = args.workers if args.workers is not None else cfg.get('workers', 1)
+  workers = min(workers, max(1, len(all)))
+
+  parquet = None
+  if cfg.get('parquet', False):
+    parquet = ParquetWriter(os.path.join(hapimeta.DATA_DIR, 'availabilities', 'availabilities.parquet'))
+
+  if workers > 1:
+    # Each server's row group is written when its worker returns, so the
+    # row groups are in the order in which the workers finish.
+    on_result = parquet.write if parquet is not None else None
+    dfs = run_workers(all, args.n_datasets, workers, on_result=on_result)
+  else:
+    dfs = {}
+    for server in all.keys():
+      dfs[server] = process_server(server, all[server], max_datasets=args.n_datasets)
+      hapimeta.error.write(server, 'availabilities', log)
+      if parquet is not None:
+        parquet.write(server, dfs[server])
+
+  if parquet is not None:
+    parquet.close()
+
+  if cfg.get('intervals', False):
+    # Static viewer for the SERVER/SERVER.intervals.json files.
+    import shutil
+    for file in ['availabilities-viewer.html', 'availabilities-viewer.js']:
+      fname = os.path.join(hapimeta.DATA_DIR, 'availabilities', file)
+      log.info(f'Writing {fname}')
+      shutil.copyfile(os.path.join(os.path.dirname(__file__), file), fname)
+
+  # Concatenate in the order of the servers in all, independent of the order
+  # in which workers finished.
+  dfs = [dfs[server] for server in all.keys() if dfs[server] is not None]
+  dfs = pandas.concat(dfs, ignore_index=True)
   write(os.path.join(hapimeta.DATA_DIR, 'availabilities', 'availabilities.pkl'), dfs)
   write(os.path.join(hapimeta.DATA_DIR, 'availabilities', 'availabilities.csv'), dfs)
 
@@ -1,11 +1,14 @@
 import os
+import time
+import datetime
+import threading
 
 import utilrsw
 
 import hapimeta
 
-cfg = hapimeta.config('catalogs')
-log = hapimeta.logger('catalogs')
+cfg = hapimeta.lazy(hapimeta.config, 'catalogs')
+log = hapimeta.lazy(hapimeta.logger, 'catalogs')
 
 
 def get_endpoint(abouts, endpoint, servers_only=None):
@@ -26,77 +29,135 @@ def get_endpoint(abouts, endpoint, servers_only=None):
     try:
       result = hapimeta.get(url, log=log, indent="  ", timeout=cfg['timeout'])
     except Exception as exc:
-      hapimeta.error.store(server_id, url, str(exc), log)
-      result = {
-        'x_LastUpdateAttempt': now,
-        'x_LastUpdateError': str(exc)
-      }
-
-    if endpoint == 'catalog' and 'catalog' not in result:
-      result = {
-        'x_LastUpdateAttempt': now,
-        'x_LastUpdateError': 'No catalog node in JSON response.'
-      }
-    if endpoint == 'capabilities' and 'outputFormats' not in result:
-      result = {
-        'x_LastUpdateAttempt': now,
-        'x_LastUpdateError': 'No outputFormats node in JSON response.'
-      }
-
-    if 'HAPI' in result:
-      del result['HAPI']
-    if 'status' in result:
-      del result['status']
-
-    fname = os.path.join(hapimeta.DATA_DIR, endpoint, f'{server_id}.json')
-    if 'x_LastUpdateError' in result:
-      log.info(f"  Attempting to read last successful /{endpoint} response from {fname}")
-      try:
-        result_last = utilrsw.read(fname)
-        log.info(f"  Read last successful /{endpoint} response.")
-        result = {**result_last, **result}
-      except Exception:
-        log.info(f"  No last successful /{endpoint} response found or read of it failed.")
-        continue
-    else:
-      result['x_LastUpdate'] = now
+      result = exc
+
+    result = _endpoint_result(server_id, endpoint, url, result, now)
+    if result is not None:
+      results[server_id] = result
+
+  return results
+
+
+def _endpoint_result(server_id, endpoint, url, result, now):
+  """
+  Validate the /catalog or /capabilities response result (or the exception
+  raised when requesting it) and write it to DATA_DIR/endpoint/server_id.json.
+
+  If the request failed, the last successful response is used, if available.
+  Returns None if there is no usable response.
+  """
+
+  if isinstance(result, Exception):
+    hapimeta.error.store(server_id, url, str(result), log)
+    result = {
+      'x_LastUpdateAttempt': now,
+      'x_LastUpdateError': str(result)
+    }
+
+  if endpoint == 'catalog' and 'catalog' not in result:
+    result = {
+      'x_LastUpdateAttempt': now,
+      'x_LastUpdateError': 'No catalog node in JSON response.'
+    }
+  if endpoint == 'capabilities' and 'outputFormats' not in result:
+    result = {
+      'x_LastUpdateAttempt': now,
+      'x_LastUpdateError': 'No outputFormats node in JSON response.'
+    }
+
+  if 'HAPI' in result:
+    # Keep version so that support for catalog?depth=all can be determined
+    # (see _depth_all()). It is not written to the published files.
+    _endpoint_result.versions[(server_id, endpoint)] = result['HAPI']
+    del result['HAPI']
+  if 'status' in result:
+    del result['status']
+
+  fname = os.path.join(hapimeta.DATA_DIR, endpoint, f'{server_id}.json')
+  if 'x_LastUpdateError' in result:
+    log.info(f"  Attempting to read last successful /{endpoint} response from {fname}")
+    try:
+      result_last = utilrsw.read(fname)
+      log.info(f"  Read last successful /{endpoint} response.")
+      result = {**result_last, **result}
+    except Exception:
+      log.info(f"  No last successful /{endpoint} response found or read of it failed.")
+      return None
+  else:
+    result['x_LastUpdate'] = now
+
+  try:
+    utilrsw.write(fname, result, logger=log)
+  except Exception as exc:
+    log.error(f"Error writing {fname}: {exc}. Exiting with code 1.")
+    exit(1)
+
+  return result
+
+_endpoint_result.versions = {}
 
-    results[server_id] = result
 
+def get_infos(server_id, catalog, max_datasets=None, incremental=False, completed=None):
+
+  start = time.time()
+  datasets = _info_datasets(server_id, catalog, max_datasets=max_datasets)
+  if datasets is None:
+    return None
+
+  kwargs = {'log': log, 'indent': '  ', 'timeout': cfg['timeout']}
+
+  remaining, stats = _refresh_plan(server_id, datasets, incremental=incremental, completed=completed)
+  if len(remaining) > 0 and _depth_all(server_id, catalog):
+    url = f"{catalog['about']['x_url']}/catalog?depth=all"
     try:
-      utilrsw.write(fname, result, logger=log)
+      result = hapimeta.get(url, **kwargs)
     except Exception as exc:
-      log.error(f"Error writing {fname}: {exc}. Exiting with code 1.")
-      exit(1)
+      result = exc
+    remaining = _depth_all_result(server_id, remaining, url, result)
 
-  return results
+  for dataset, url in remaining:
+    try:
+      info = hapimeta.get(url, **kwargs)
+    except Exception as exc:
+      info = exc
+    _info_result(server_id, dataset, url, info)
 
+  partial = max_datasets is not None and len(datasets) >= max_datasets
+  _write_catalog(server_id, catalog, partial=partial, max_datasets=max_datasets)
 
-def get_infos(server_id, catalog, max_datasets=None):
+  stats['duration'] = round(time.time() - start, 3)
+  return stats
+
+
+def _info_datasets(server_id, catalog, max_datasets=None):
+  """
+  Return a list of (dataset, url) for the /info requests needed for a server
+  or None if the catalog for the server can not be used.
+  """
 
   if 'catalog' not in catalog:
     msg = f"  Skipping {server_id} because no /catalog response."
     hapimeta.error.store(server_id, '_', msg, log)
-    return
+    return None
 
   if 'catalog' not in catalog['catalog']:
     msg = f"  Skipping {server_id} because no 'catalog' node in /catalog response."
     hapimeta.error.store(server_id, '_', msg, log)
-    return
+    return None
 
   if 'about' not in catalog:
     msg = f"  Skipping {server_id} because no /about response."
     hapimeta.error.store(server_id, '_', msg, log)
-    return
+    return None
 
   if 'x_url' not in catalog['about']:
     msg = f"  Skipping {server_id} because no 'x_url' about node."
     hapimeta.error.store(server_id, '_', msg, log)
-    return
+    return None
 
   log.info(f"{server_id}")
 
-  n = 1
+  datasets = []
   for didx, dataset in enumerate(catalog['catalog']['catalog']):
 
     if 'id' not in dataset:
@@ -104,62 +165,400 @@ def get_infos(server_id, catalog, max_datasets=None):
       hapimeta.error.store(server_id, '_', msg, log)
       continue
 
+    url = f"{catalog['about']['x_url']}/info?id={dataset['id']}"
+    datasets.append((dataset, url))
+
+    if max_datasets is not None and len(datasets) >= max_datasets:
+      break
+
+  return datasets
+
+
+def _refresh_plan(server_id, datasets, incremental=False, completed=None):
+  """
+  Determine which of datasets need an /info request.
+
+  Datasets in completed, a set of (server_id, dataset_id) read from the
+  journal of an interrupted run, are not requested again; their info is read
+  from DATA_DIR/infos/.
+
+  If incremental is False, all other datasets are requested. Otherwise, the
+  catalog entries are compared with those in the last DATA_DIR/catalog/
+  server_id-all.json and /info is only requested for new datasets, datasets
+  with a catalog entry that changed, and datasets in the rotating sample
+  (each dataset is in the sample once every cfg['refresh_days'] days). For
+  all other datasets, dataset['info'] is read from DATA_DIR/infos/.
+
+  Returns (list of (dataset, url) to request, dict of counts).
+  """
+
+  stats = {
+    'datasets': len(datasets),
+    'fetched': len(datasets),
+    'reused': 0,
+    'removed': 0
+  }
+
+  if completed:
+    todo = []
+    for dataset, url in datasets:
+      if (server_id, dataset['id']) in completed and _read_info(server_id, dataset):
+        continue
+      todo.append((dataset, url))
+    stats['resumed'] = len(datasets) - len(todo)
+    stats['fetched'] = len(todo)
+    log.info(f"  Resume: {stats['resumed']} /info responses read from last run.")
+  else:
+    todo = datasets
+
+  if not incremental:
+    return todo, stats
+
+  fname = os.path.join(hapimeta.DATA_DIR, 'catalog', f'{server_id}-all.json')
+  try:
+    catalog_last = utilrsw.read(fname)['catalog']
+  except Exception:
+    log.info(f"  No last catalog found in {fname} or read of it failed. Requesting all /info responses.")
+    return todo, stats
+
+  hashes_last = {}
+  for dataset in catalog_last:
+    if 'id' in dataset:
+      hashes_last[dataset['id']] = _entry_hash(dataset)
+
+  day = datetime.date.today().toordinal()
+  refresh_days = max(1, cfg['refresh_days'])
+
+  counts = {'new': 0, 'changed': 0, 'sampled': 0}
+  remaining = []
+  for dataset, url in todo:
     dataset_id = dataset['id']
-    url = f"{catalog['about']['x_url']}/info?id={dataset_id}"
 
-    try:
-      kwargs = {'log': log, 'indent': '  ', 'timeout': cfg['timeout']}
-      info = hapimeta.get(url, **kwargs)
-      info['x_LastUpdate'] = utilrsw.time.utc_now()
-    except Exception as exc:
-      hapimeta.error.store(server_id, url, str(exc), log)
-      info = {
-        'x_LastUpdateError': str(exc),
-        'x_LastUpdateAttempt': utilrsw.time.utc_now()
-      }
-
-    if 'parameters' not in info:
-      hapimeta.error.store(server_id, url, 'No parameters node in JSON response.', log)
-      info = {
-        'x_LastUpdateAttempt': utilrsw.time.utc_now(),
-        'x_LastUpdateError': 'No parameters node in JSON response.'
-      }
-
-    fname = os.path.join(hapimeta.DATA_DIR, 'infos', server_id, f'{dataset_id}.json')
-    if 'x_LastUpdateError' in info:
-      log.info('  Attempting to read last successful /info response.')
-      try:
-        info_last = utilrsw.read(fname)
-        log.info('  Read last successful /info response.')
-        info = {**info_last, **info}
-      except Exception:
-        hapimeta.error.store(server_id, url, 'No last successful /info response found.', log)
+    reason = None
+    if dataset_id not in hashes_last:
+      reason = 'new'
+    elif _entry_hash(dataset) != hashes_last[dataset_id]:
+      reason = 'changed'
+    elif int(_hash(dataset_id), 16) % refresh_days == day % refresh_days:
+      reason = 'sampled'
+
+    if reason is None:
+      if _read_info(server_id, dataset):
         continue
-    else:
-      info['x_LastUpdate'] = utilrsw.time.utc_now()
+      log.info(f"  No last /info response found for {dataset_id}. Requesting it.")
+      reason = 'new'
+
+    counts[reason] += 1
+    remaining.append((dataset, url))
+
+  ids = set(dataset['id'] for dataset, _ in datasets)
+  stats['fetched'] = len(remaining)
+  stats['reused'] = len(todo) - len(remaining)
+  stats['removed'] = len([id for id in hashes_last if id not in ids])
+  stats = {**stats, **counts}
+
+  msg = f"  Incremental: {stats['fetched']} to request ({counts['new']} new, "
+  msg += f"{counts['changed']} changed, {counts['sampled']} sampled), "
+  msg += f"{stats['reused']} reused, {stats['removed']} removed"
+  log.info(msg)
+
+  return remaining, stats
+
+
+def _read_info(server_id, dataset):
+  """Set dataset['info'] from DATA_DIR/infos/. Returns False if read fails."""
+  fname = os.path.join(hapimeta.DATA_DIR, 'infos', server_id, f"{dataset['id']}.json")
+  try:
+    dataset['info'] = _strip_bins(utilrsw.read(fname))
+  except Exception:
+    return False
+  return True
+
+
+def _entry_hash(dataset):
+  """Hash of a catalog entry without the info node added by this code."""
+  import json
+  entry = {key: value for key, value in dataset.items() if key != 'info'}
+  return _hash(json.dumps(entry, sort_keys=True, default=str))
+
+
+def _hash(string):
+  import hashlib
+  return hashlib.sha1(string.encode('utf-8')).hexdigest()
+
+
+def _depth_all(server_id, catalog):
+  """
+  True if the server reports a HAPI version of 3.2 or higher in its /about,
+  /capabilities, or /catalog response, which means that all /info responses
+  can be requested at once using /catalog?depth=all.
+  """
 
+  if not cfg['depth_all']:
+    return False
+
+  versions = [
+    utilrsw.get_path(catalog, 'about/HAPI', sep='/'),
+    _endpoint_result.versions.get((server_id, 'capabilities')),
+    _endpoint_result.versions.get((server_id, 'catalog'))
+  ]
+  for version in versions:
     try:
-      log.info(f"  Writing {fname}")
-      utilrsw.write(fname, info)
-    except Exception as exc:
-      log.error(f"  Error writing {fname}: {exc}")
+      version = tuple(int(part) for part in str(version).split('.')[0:2])
+    except ValueError:
+      continue
+    if version >= (3, 2):
+      return True
 
-    if 'parameters' in info:
-      for parameter in info['parameters']:
-        if 'bins' in parameter:
-          if 'centers' in parameter['bins']:
-            del parameter['bins']['centers']
-          if 'ranges' in parameter['bins']:
-            del parameter['bins']['ranges']
+  return False
 
-    dataset['info'] = info
 
-    if max_datasets is not None and n >= max_datasets:
-      log.info(f"Stopping because {max_datasets} /info requests made.")
-      hapimeta.error.write(server_id, 'catalogs', log)
-      return
+def _depth_all_result(server_id, datasets, url, result):
+  """
+  Handle the /catalog?depth=all response result (or the exception raised when
+  requesting it) by passing each dataset's info node to _info_result().
+
+  Returns the list of (dataset, url) for datasets that were not in the
+  response or had no usable info node. These must be requested individually.
+  """
+
+  if isinstance(result, Exception):
+    msg = f"{result}. Falling back to /info requests."
+    hapimeta.error.store(server_id, url, msg, log)
+    return datasets
 
-    n = n + 1
+  entries = result.get('catalog', None) if isinstance(result, dict) else None
+  if not isinstance(entries, list):
+    msg = "No catalog node in JSON response. Falling back to /info requests."
+    hapimeta.error.store(server_id, url, msg, log)
+    return datasets
+
+  infos = {}
+  for entry in entries:
+    if not isinstance(entry, dict) or 'id' not in entry:
+      continue
+    info = entry.get('info', None)
+    if isinstance(info, dict) and 'parameters' in info:
+      infos[entry['id']] = info
+
+  remaining = []
+  for dataset, info_url in datasets:
+    if dataset['id'] in infos:
+      _info_result(server_id, dataset, info_url, infos[dataset['id']])
+    else:
+      remaining.append((dataset, info_url))
+
+  n_found = len(datasets) - len(remaining)
+  log.info(f"  {n_found}/{len(datasets)} /info responses found in {url}")
+  if len(remaining) > 0:
+    msg = f"{len(remaining)} datasets with no info node. Making /info requests for them."
+    hapimeta.error.store(server_id, url, msg, log)
+
+  return remaining
+
+
+def _info_result(server_id, dataset, url, info):
+  """
+  Handle the /info response info (or the exception raised when requesting it)
+  for dataset: write it to DATA_DIR/infos/server_id/dataset_id.json and put a
+  copy with bins centers and ranges removed in dataset['info'].
+
+  If the request failed, the last successful response is used, if available.
+  Returns False if no /info response could be stored.
+  """
+
+  if isinstance(info, Exception):
+    hapimeta.error.store(server_id, url, str(info), log)
+    info = {
+      'x_LastUpdateError': str(info),
+      'x_LastUpdateAttempt': utilrsw.time.utc_now()
+    }
+
+  if 'parameters' not in info:
+    hapimeta.error.store(server_id, url, 'No parameters node in JSON response.', log)
+    info = {
+      'x_LastUpdateAttempt': utilrsw.time.utc_now(),
+      'x_LastUpdateError': 'No parameters node in JSON response.'
+    }
+
+  fname = os.path.join(hapimeta.DATA_DIR, 'infos', server_id, f"{dataset['id']}.json")
+  if 'x_LastUpdateError' in info:
+    log.info('  Attempting to read last successful /info response.')
+    try:
+      info_last = utilrsw.read(fname)
+      log.info('  Read last successful /info response.')
+      info = {**info_last, **info}
+    except Exception:
+      hapimeta.error.store(server_id, url, 'No last successful /info response found.', log)
+      return False
+  else:
+    info['x_LastUpdate'] = utilrsw.time.utc_now()
+
+  try:
+    log.info(f"  Writing {fname}")
+    utilrsw.write(fname, info)
+    journal({'server': server_id, 'dataset': dataset['id']})
+  except Exception as exc:
+    log.error(f"  Error writing {fname}: {exc}")
+
+  dataset['info'] = _strip_bins(info)
+
+  return True
+
+
+def _strip_bins(info):
+  if 'parameters' in info:
+    for parameter in info['parameters']:
+      if 'bins' in parameter:
+        if 'centers' in parameter['bins']:
+          del parameter['bins']['centers']
+        if 'ranges' in parameter['bins']:
+          del parameter['bins']['ranges']
+  return info
+
+
+def journal(record, reset=False, sync=False):
+  """
+  Append record to DATA_DIR/catalogs-journal.jsonl, which is used by --resume.
+
+  The /catalog and /capabilities responses used by the run (see
+  journal_catalogs()) and each /info response written to DATA_DIR/infos/
+  are recorded so that a run that was interrupted can be resumed with the
+  same datasets and without requesting them again. If reset is True, the
+  journal is started over.
+
+  Each record is flushed before returning, so it survives the process being
+  killed. Records are synced to disk (fsync) if reset or sync is True and
+  otherwise at most every journal.sync_records records or
+  journal.sync_interval seconds, outside of the lock, so that threads
+  recording /info responses do not wait for one sync each. After a crash or
+  reboot, /info responses whose records were not synced are requested again
+  by --resume.
+  """
+  import json
+
+  if not journal.enabled:
+    return
+
+  record = {**record, 'time': utilrsw.time.utc_now()}
+  with journal.lock:
+    if reset or journal.fout is None:
+      if journal.fout is not None:
+        journal.fout.close()
+      os.makedirs(os.path.dirname(journal.fname), exist_ok=True)
+      journal.fout = open(journal.fname, 'w' if reset else 'a')
+    journal.fout.write(json.dumps(record) + '\n')
+    journal.fout.flush()
+    journal.n_unsynced += 1
+    now = time.time()
+    sync = sync or reset or journal.n_unsynced >= journal.sync_records
+    sync = sync or now - journal.last_sync >= journal.sync_interval
+    if sync:
+      journal.n_unsynced = 0
+      journal.last_sync = now
+      fileno = journal.fout.fileno()
+
+  if sync:
+    os.fsync(fileno)
+
+journal.fname = os.path.join(hapimeta.DATA_DIR, 'catalogs-journal.jsonl')
+journal.lock = threading.Lock()
+journal.enabled = False
+journal.fout = None
+journal.n_unsynced = 0
+journal.last_sync = 0.0
+journal.sync_records = 100
+journal.sync_interval = 1.0
+
+
+def close_journal():
+  """Sync and close the journal."""
+  with journal.lock:
+    if journal.fout is not None:
+      journal.fout.flush()
+      os.fsync(journal.fout.fileno())
+      journal.fout.close()
+      journal.fout = None
+      journal.n_unsynced = 0
+
+
+def journal_catalogs(catalogs):
+  """
+  Record the /catalog and /capabilities responses (catalogs, as returned by
+  catalogs_dict()) used by this run, so --resume uses the same datasets.
+  """
+  versions = [[*key, version] for key, version in _endpoint_result.versions.items()]
+  journal({'catalogs': catalogs, 'versions': versions}, sync=True)
+
+
+def read_journal(servers_only=None, max_datasets=None):
+  """
+  Read the journal of the last run.
+
+  Returns (completed, catalogs), where completed is a set of
+  (server_id, dataset_id) with completed /info requests and catalogs is the
+  content recorded by journal_catalogs(), or None if there is no journal,
+  the last run finished, the last run was for different servers or
+  --n-datasets, or it was interrupted before its /catalog and /capabilities
+  responses were recorded.
+  """
+  import json
+
+  if not os.path.exists(journal.fname):
+    log.info(f'No journal {journal.fname} found. Not resuming.')
+    return None
+
+  records = []
+  with open(journal.fname) as fin:
+    for line in fin:
+      try:
+        records.append(json.loads(line))
+      except json.JSONDecodeError:
+        # Last line may be incomplete if the process was killed while writing.
+        continue
+
+  if len(records) == 0 or 'start' not in records[0]:
+    log.info(f'No start record in {journal.fname}. Not resuming.')
+    return None
+
+  start = records[0]
+  if start.get('servers_only') != servers_only or start.get('max_datasets') != max_datasets:
+    msg = f'Last run started at {start["start"]} used servers_only = {start.get("servers_only")} '
+    msg += f'and max_datasets = {start.get("max_datasets")}. Not resuming.'
+    log.info(msg)
+    return None
+
+  if any('finished' in record for record in records):
+    log.info(f'Last run started at {start["start"]} finished. Not resuming.')
+    return None
+
+  catalogs = None
+  completed = set()
+  for record in records[1:]:
+    if 'catalogs' in record:
+      catalogs = record['catalogs']
+      for server_id, endpoint, version in record.get('versions', []):
+        _endpoint_result.versions[(server_id, endpoint)] = version
+    if 'dataset' in record:
+      completed.add((record['server'], record['dataset']))
+
+  if catalogs is None:
+    msg = f'Last run started at {start["start"]} was interrupted before its /catalog '
+    msg += 'and /capabilities responses were recorded. Not resuming.'
+    log.info(msg)
+    return None
+
+  log.info(f'Resuming run started at {start["start"]} with {len(completed)} completed /info requests.')
+  return completed, catalogs
+
+
+def _write_catalog(server_id, catalog, partial=False, max_datasets=None):
+
+  if partial:
+    # Do not overwrite the full catalog with a partial one.
+    log.info(f"Stopping because {max_datasets} /info requests made.")
+    hapimeta.error.write(server_id, 'catalogs', log)
+    return
 
   try:
     fname = os.path.join(hapimeta.DATA_DIR, 'catalog', f'{server_id}-all.json')
@@ -201,28 +600,7 @@ def write(file_name, data, pkl=False):
     exit(1)
 
 
-def run():
-  args = hapimeta.cli()
-  servers_only = args.servers
-  max_datasets = 1 if cfg['debug'] else cfg['max_datasets']
-  if args.n_datasets is not None:
-    max_datasets = args.n_datasets
-  endpoints = {}
-  log.info(40*'-')
-  log.info('Reading abouts.')
-  log.info(40*'-')
-  abouts = read_abouts(cfg['servers_repo'], cfg['about_files'])
-  if servers_only is None and args.n_servers is not None:
-    servers_only = [about['id'] for about in abouts[:args.n_servers]]
-
-  endpoints['about'] = utilrsw.array_to_dict(abouts, 'id')
-
-  for endpoint in ['catalog', 'capabilities']:
-    log.info(40*'-')
-    log.info(f'Starting /{endpoint} requests')
-    log.info(40*'-')
-    endpoints[endpoint] = get_endpoint(abouts, endpoint, servers_only=servers_only)
-
+def catalogs_dict(abouts, endpoints, servers_only=None):
   catalogs = {}
   for about in abouts:
     server_id = about['id']
@@ -234,32 +612,324 @@ def run():
         catalog[endpoint] = endpoints[endpoint][server_id]
     catalogs[server_id] = catalog
 
-  write(os.path.join(hapimeta.DATA_DIR, 'catalogs.json'), catalogs, pkl=False)
+  return catalogs
+
+
+def run_threads(abouts, servers_only=None, max_datasets=None, incremental=False,
+                completed=None, catalogs=None):
+
+  if catalogs is None:
+    endpoints = {}
+    endpoints['about'] = utilrsw.array_to_dict(abouts, 'id')
+
+    for endpoint in ['catalog', 'capabilities']:
+      log.info(40*'-')
+      log.info(f'Starting /{endpoint} requests')
+      log.info(40*'-')
+      endpoints[endpoint] = get_endpoint(abouts, endpoint, servers_only=servers_only)
+
+    catalogs = catalogs_dict(abouts, endpoints, servers_only=servers_only)
+    write(os.path.join(hapimeta.DATA_DIR, 'catalogs.json'), catalogs, pkl=False)
+    journal_catalogs(catalogs)
 
   log.info(40*'-')
   log.info('Starting /info requests.')
   log.info(40*'-')
+  stats = {}
+  kwargs = {
+    'max_datasets': max_datasets,
+    'incremental': incremental,
+    'completed': completed
+  }
   if cfg['max_workers'] == 1:
     for server_id in catalogs.keys():
       if 'catalog' not in catalogs[server_id]:
         continue
-      get_infos(server_id, catalogs[server_id], max_datasets=max_datasets)
+      stats[server_id] = get_infos(server_id, catalogs[server_id], **kwargs)
   else:
-    def call(server_id):
-      if 'catalog' not in catalogs[server_id]:
-        return
-      get_infos(server_id, catalogs[server_id], max_datasets=max_datasets)
+    stats = get_infos_scheduled(catalogs, **kwargs)
+
+  return catalogs, stats
+
+
+def get_infos_scheduled(catalogs, max_datasets=None, incremental=False, completed=None):
+  """
+  Make the /info requests for all servers with hapimeta.scheduler.
+
+  Each (server, dataset) request is a separate task, so idle workers take
+  requests for servers with many datasets instead of each server being
+  handled by one thread. At most cfg['max_in_flight_per_server'] requests
+  are made to a server at once. Servers expected to take the longest, based
+  on catalogs-stats.json from the last run, are started first.
+  """
+
+  kwargs = {'log': log, 'indent': '  ', 'timeout': cfg['timeout']}
+
+  stats = {}
+  tasks = {}
+  datasets_all = {}
+  for server_id, catalog in catalogs.items():
+    if 'catalog' not in catalog:
+      continue
+    datasets = _info_datasets(server_id, catalog, max_datasets=max_datasets)
+    if datasets is None:
+      continue
+    datasets_all[server_id] = datasets
+    kwargs_plan = {'incremental': incremental, 'completed': completed}
+    remaining, stats[server_id] = _refresh_plan(server_id, datasets, **kwargs_plan)
+    if len(remaining) > 0 and _depth_all(server_id, catalog):
+      url = f"{catalog['about']['x_url']}/catalog?depth=all"
+      tasks[server_id] = [('depth_all', url, remaining)]
+    else:
+      tasks[server_id] = [('info', dataset, url) for dataset, url in remaining]
 
-    import concurrent.futures
-    with concurrent.futures.ThreadPoolExecutor(max_workers=cfg['max_workers']) as pool:
-      pool.map(call, catalogs.keys())
+  tasks = {server_id: tasks[server_id] for server_id in _order(tasks)}
+
+  starts = {}
+
+  def call(server_id, task):
+    starts.setdefault(server_id, time.time())
+    if task[0] == 'depth_all':
+      _, url, datasets = task
+      try:
+        result = hapimeta.get(url, **kwargs)
+      except Exception as exc:
+        result = exc
+      remaining = _depth_all_result(server_id, datasets, url, result)
+      return [('info', dataset, url) for dataset, url in remaining]
+
+    _, dataset, url = task
+    try:
+      info = hapimeta.get(url, **kwargs)
+    except Exception as exc:
+      info = exc
+    _info_result(server_id, dataset, url, info)
+
+  def done(server_id):
+    datasets = datasets_all[server_id]
+    partial = max_datasets is not None and len(datasets) >= max_datasets
+    _write_catalog(server_id, catalogs[server_id], partial=partial, max_datasets=max_datasets)
+    now = time.time()
+    duration = now - starts.get(server_id, now)
+    stats[server_id]['duration'] = round(duration, 3)
+
+  kwargs_scheduler = {
+    'max_workers': cfg['max_workers'],
+    'max_per_key': cfg['max_in_flight_per_server'],
+    'on_key_done': done,
+    'log': log
+  }
+  hapimeta.scheduler.run(tasks, call, **kwargs_scheduler)
+
+  return stats
+
+
+def _order(tasks):
+  """
+  Return server ids in tasks sorted by expected time to complete, longest
+  first. The time per request for a server is taken from the last run's
+  catalogs-stats.json; if not available, the average over all servers is used.
+  """
+
+  fname = os.path.join(hapimeta.DATA_DIR, 'catalogs-stats.json')
+  try:
+    stats_last = utilrsw.read(fname)
+  except Exception:
+    stats_last = {}
+
+  def per_request(server_stats):
+    if not isinstance(server_stats, dict):
+      return None
+    if not server_stats.get('fetched') or server_stats.get('duration') is None:
+      return None
+    return server_stats['duration']/server_stats['fetched']
+
+  times = [per_request(stats_last[server_id]) for server_id in stats_last]
+  times = [t for t in times if t is not None]
+  default = sum(times)/len(times) if len(times) > 0 else 1.0
+
+  def cost(server_id):
+    t = per_request(stats_last.get(server_id))
+    if t is None:
+      t = default
+    n = len(tasks[server_id])
+    if n == 1 and tasks[server_id][0][0] == 'depth_all':
+      n = len(tasks[server_id][0][2])
+    return n*t
+
+  return sorted(tasks.keys(), key=cost, reverse=True)
+
+
+async def run_async(abouts, servers_only=None, max_datasets=None, incremental=False,
+                    completed=None, catalogs=None):
+  """
+  Make all /catalog, /capabilities, and /info requests from one event loop.
+
+  At most cfg['max_in_flight'] requests are in flight at any time and at most
+  cfg['max_in_flight_per_server'] to a single server. The /info requests for
+  a server are not made one after another as they are with run_threads().
+
+  Handling of responses, which reads and writes files and the journal, is
+  run in threads with asyncio.to_thread() so that it does not block the
+  event loop.
+  """
+  import asyncio
+  import aiohttp
+
+  limit = asyncio.Semaphore(cfg['max_in_flight'])
+  server_limits = {}
+
+  async def get(session, server_id, url):
+    if server_id not in server_limits:
+      server_limits[server_id] = asyncio.Semaphore(cfg['max_in_flight_per_server'])
+    async with server_limits[server_id], limit:
+      try:
+        kwargs = {'log': log, 'indent': '  ', 'timeout': cfg['timeout']}
+        return await hapimeta.aget(session, url, **kwargs)
+      except Exception as exc:
+        return exc
+
+  async def get_endpoint(session, about, endpoint, endpoints):
+    now = utilrsw.time.utc_now()
+    url = f"{about['x_url']}/{endpoint}"
+    result = await get(session, about['id'], url)
+    result = await asyncio.to_thread(_endpoint_result, about['id'], endpoint, url, result, now)
+    if result is not None:
+      endpoints[endpoint][about['id']] = result
+
+  async def get_info(session, server_id, dataset, url):
+    info = await get(session, server_id, url)
+    await asyncio.to_thread(_info_result, server_id, dataset, url, info)
+
+  async def get_infos(session, server_id, catalog, stats):
+    if 'catalog' not in catalog:
+      return
+    start = time.time()
+    datasets = _info_datasets(server_id, catalog, max_datasets=max_datasets)
+    if datasets is None:
+      return
+    kwargs_plan = {'incremental': incremental, 'completed': completed}
+    plan = await asyncio.to_thread(_refresh_plan, server_id, datasets, **kwargs_plan)
+    remaining, stats[server_id] = plan
+    if len(remaining) > 0 and _depth_all(server_id, catalog):
+      url = f"{catalog['about']['x_url']}/catalog?depth=all"
+      result = await get(session, server_id, url)
+      remaining = await asyncio.to_thread(_depth_all_result, server_id, remaining, url, result)
+    await asyncio.gather(*[get_info(session, server_id, dataset, url) for dataset, url in remaining])
+    partial = max_datasets is not None and len(datasets) >= max_datasets
+    kwargs_write = {'partial': partial, 'max_datasets': max_datasets}
+    await asyncio.to_thread(_write_catalog, server_id, catalog, **kwargs_write)
+    stats[server_id]['duration'] = round(time.time() - start, 3)
+
+  kwargs = {
+    'limit': cfg['max_in_flight'],
+    'limit_per_host': cfg['max_in_flight_per_server']
+  }
+  connector = aiohttp.TCPConnector(**kwargs)
+  headers = {'User-Agent': hapimeta.sessions.user_agent()}
+  async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
+
+    if catalogs is None:
+      abouts_only = abouts
+      if servers_only is not None:
+        abouts_only = [about for about in abouts if about['id'] in servers_only]
+
+      log.info(40*'-')
+      log.info('Starting /catalog and /capabilities requests')
+      log.info(40*'-')
+      endpoints = {'catalog': {}, 'capabilities': {}}
+      tasks = []
+      for endpoint in endpoints.keys():
+        for about in abouts_only:
+          tasks.append(get_endpoint(session, about, endpoint, endpoints))
+      await asyncio.gather(*tasks)
+
+      catalogs = catalogs_dict(abouts, endpoints, servers_only=servers_only)
+      fname = os.path.join(hapimeta.DATA_DIR, 'catalogs.json')
+      await asyncio.to_thread(write, fname, catalogs, pkl=False)
+      await asyncio.to_thread(journal_catalogs, catalogs)
+
+    log.info(40*'-')
+    log.info('Starting /info requests.')
+    log.info(40*'-')
+    stats = {}
+    await asyncio.gather(*[get_infos(session, server_id, catalog, stats) for server_id, catalog in catalogs.items()])
+
+  return catalogs, stats
+
+
+def run():
+  args = hapimeta.cli()
+  servers_only = args.servers
+  max_datasets = 1 if cfg['debug'] else cfg['max_datasets']
+  if args.n_datasets is not None:
+    max_datasets = args.n_datasets
+  engine = cfg['engine'] if args.engine is None else args.engine
+  incremental = cfg['incremental'] or args.incremental
+
+  log.info(40*'-')
+  log.info('Reading abouts.')
+  log.info(40*'-')
+  abouts = read_abouts(cfg['servers_repo'], cfg['about_files'])
+  if servers_only is None and args.n_servers is not None:
+    servers_only = [about['id'] for about in abouts[:args.n_servers]]
+
+  # Size per-host connection pools so that all workers can keep a connection
+  # to the same server open.
+  hapimeta.sessions.configure(pool_maxsize=cfg['max_workers'])
+
+  completed = None
+  catalogs = None
+  if args.resume:
+    # Use the /catalog and /capabilities responses of the interrupted run
+    # so that the datasets are the same as those in the journal.
+    resumed = read_journal(servers_only=servers_only, max_datasets=max_datasets)
+    if resumed is not None:
+      completed, catalogs = resumed
+
+  journal.enabled = True
+  if completed is None:
+    start = {
+      'start': utilrsw.time.utc_now(),
+      'servers_only': servers_only,
+      'max_datasets': max_datasets
+    }
+    journal(start, reset=True)
+
+  log.info(f'Using {engine} engine.')
+  kwargs = {
+    'servers_only': servers_only,
+    'max_datasets': max_datasets,
+    'incremental': incremental,
+    'completed': completed,
+    'catalogs': catalogs
+  }
+  if engine == 'async':
+    import asyncio
+    catalogs, stats = asyncio.run(run_async(abouts, **kwargs))
+  else:
+    catalogs, stats = run_threads(abouts, **kwargs)
 
   log.info(40*'-')
   log.info('Finished /info requests.')
   log.info(40*'-')
+  hapimeta.sessions.log_stats(log)
 
+  stats = {server_id: stats[server_id] for server_id in catalogs if stats.get(server_id) is not None}
+  write(os.path.join(hapimeta.DATA_DIR, 'catalogs-stats.json'), stats, pkl=False)
   write(os.path.join(hapimeta.DATA_DIR, 'catalogs-all.json'), catalogs, pkl=True)
 
+  # Per-server shards so that hapimeta.all() only reads servers that are used.
+  shard_dir = os.path.join(hapimeta.DATA_DIR, hapimeta.config('common')['ALL_DIR'])
+  try:
+    hapimeta.shards.write(catalogs, shard_dir, log)
+  except Exception as exc:
+    log.error(f"Error writing shards to {shard_dir}: {exc}. Exiting with code 1.")
+    exit(1)
+
+  journal({'finished': True}, sync=True)
+  close_journal()
+
 
 if __name__ == '__main__':
   run()
\ No newline at end of file
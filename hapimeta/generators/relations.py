@@ -1,13 +1,13 @@
 # Usage: python run.py relations [WDC, INTERMAGNET]
 
-from rdflib import Graph, Namespace, URIRef
-
 import hapimeta
 
-log = hapimeta.logger('relations')
-cfg = hapimeta.config('relations')
+log = hapimeta.lazy(hapimeta.logger, 'relations')
+cfg = hapimeta.lazy(hapimeta.config, 'relations')
 
 def relations(server_id, all, observatory=None, max_datasets=None):
+  from rdflib import Graph
+
   if server_id == 'INTERMAGNET':
     url = 'https://imag-data.bgs.ac.uk/GIN_V1/hapi'
 
@@ -126,12 +126,16 @@ def _observatories(dataset_ids, server_id):
 
 
 def _head(g, url):
+  from rdflib import URIRef
+
   g.bind('hapi', _namespace('HAPI'))
   g.bind('dcat', _namespace('DCAT'))
   g.base = URIRef(url)
 
 
 def _provides(g, dataset_ids):
+  from rdflib import URIRef
+
   g.add((g.base, _namespace('RDF').type, _namespace('HAPI').Service))
   for dataset_id in dataset_ids:
     uri_ref = f'/info?dataset={dataset_id}'
@@ -141,6 +145,8 @@ def _provides(g, dataset_ids):
 
 
 def _definitions(g, dataset_ids, catalog):
+  from rdflib import URIRef
+
   for dataset_id in dataset_ids:
     uri_dataset = URIRef(f'/info?dataset={dataset_id}')
     g.add((uri_dataset, _namespace('RDF').type, _namespace('HAPI').Dataset))
@@ -152,6 +158,8 @@ def _definitions(g, dataset_ids, catalog):
 
 
 def _cadence_relations(g, dataset_ids_parts, catalog, server_id):
+  from rdflib import URIRef
+
   def min_cadence(cadences):
     import datetime
     import utilrsw
@@ -196,6 +204,8 @@ def _cadence_relations(g, dataset_ids_parts, catalog, server_id):
 
 
 def _quality_relations(g, dataset_ids_parts):
+  from rdflib import URIRef
+
   for observatory in dataset_ids_parts.keys():
     qualities = dataset_ids_parts[observatory]['qualities']
     if 'reported' in qualities:
@@ -217,6 +227,8 @@ def _quality_relations(g, dataset_ids_parts):
 
 
 def _frame_relations(g, dataset_ids_parts, catalog, server_id):
+  from rdflib import URIRef
+
   if server_id == 'INTERMAGNET':
     base_frame = 'native'
   if server_id == 'WDC':
@@ -258,6 +270,7 @@ def _frame_relations(g, dataset_ids_parts, catalog, server_id):
 
 
 def _namespace(namespace_name):
+  from rdflib import Namespace
   from functools import lru_cache
   @lru_cache(maxsize=None)
   def get_namespace(namespace_name):
@@ -4,8 +4,8 @@ import utilrsw
 
 import hapimeta
 
-cfg = hapimeta.config('spase')
-log = hapimeta.logger('spase')
+cfg = hapimeta.lazy(hapimeta.config, 'spase')
+log = hapimeta.lazy(hapimeta.logger, 'spase')
 
 def run():
 
@@ -1,15 +1,12 @@
 import datetime
 
 import utilrsw
-import tableui
-
-import hapiclient
 
 import hapimeta
 
-cfg = hapimeta.config('table')
+cfg = hapimeta.lazy(hapimeta.config, 'table')
 
-log = hapimeta.logger('table')
+log = hapimeta.lazy(hapimeta.logger, 'table')
 
 
 def reorder_keys(d):
@@ -44,7 +41,7 @@ def format_bins(bins):
 def normalize_datetime(time_str):
   try:
     time_str = str(time_str).strip()
-    dt = hapiclient.hapitime2datetime(time_str)[0]
+    dt = hapimeta.hapitime.parse(time_str)
     if dt.tzinfo is None:
       dt = dt.replace(tzinfo=datetime.timezone.utc)
     return dt.strftime('%Y-%m-%dT%H:%M:%S.%f') + 'Z'
@@ -54,92 +51,310 @@ def normalize_datetime(time_str):
 
 
 def compute_rows(all, omits=[], max_datasets=None):
-
+  """Return {'dataset': [...], 'parameter': [...]} with the rows for all servers."""
   rows = {
     'dataset': [],
     'parameter': []
   }
+  for server, server_rows_ in iter_rows(all, omits=omits, max_datasets=max_datasets):
+    rows['dataset'].extend(server_rows_['dataset'])
+    rows['parameter'].extend(server_rows_['parameter'])
+  return rows
+
+
+def iter_rows(all, omits=[], max_datasets=None, workers=1):
+  """
+  Yield (server, rows) for each server in all, where rows is the return
+  value of server_rows(). A server's catalog is released after its rows are
+  computed, so only one server's catalog and rows are in memory at a time.
+
+  If workers > 1, rows are computed by iter_rows_workers().
+  """
+  if workers > 1:
+    yield from iter_rows_workers(all, omits, max_datasets, workers)
+    return
 
   for server in all:
+    rows = server_rows(server, all[server], omits=omits, max_datasets=max_datasets)
+    if hasattr(all, 'release'):
+      all.release(server)
+    yield server, rows
+
+
+def iter_rows_workers(all, omits, max_datasets, workers):
+  """
+  Like iter_rows(), but compute the rows of servers in a pool of worker
+  processes.
+
+  Rows are yielded in the order of the servers in all, independent of the
+  order in which workers finish. At most 2*workers servers are submitted
+  ahead of the one being yielded, so the rows of servers that finished early
+  do not accumulate in memory.
+  """
+  import collections
+  import concurrent.futures
+
+  log.info(f'Computing rows for {len(all)} servers using {workers} worker processes')
+
+  def result(server, future):
+    try:
+      return server, future.result()
+    except Exception as exc:
+      log.error(f'{server}: Uncaught exception in worker: {exc}')
+      raise
+
+  pending = collections.deque()
+  with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+    for server in all:
+      # Workers get the pickled catalog, which is only unpickled by them.
+      data = all.raw(server) if hasattr(all, 'raw') else all[server]
+      pending.append((server, pool.submit(server_rows_worker, server, data, omits, max_datasets)))
+      if len(pending) >= 2 * workers:
+        yield result(*pending.popleft())
+    while len(pending) > 0:
+      yield result(*pending.popleft())
+
+
+def server_rows_worker(server, server_meta, omits, max_datasets):
+  """Run server_rows() in a worker process; server_meta may be pickled."""
+  import pickle
+
+  if isinstance(server_meta, bytes):
+    server_meta = pickle.loads(server_meta)
+  return server_rows(server, server_meta, omits=omits, max_datasets=max_datasets)
+
+
+def server_rows(server, server_meta, omits=[], max_datasets=None):
+  """Return {'dataset': [...], 'parameter': [...]} with the rows for server."""
 
-    log.info(f'Generating table for {server}')
+  rows = {
+    'dataset': [],
+    'parameter': []
+  }
 
-    catalog = utilrsw.get_path(all[server], 'catalog/catalog', sep='/')
-    if catalog is None:
-      log.error(f'Could not find catalog for server: {server}. Skipping server.')
-      continue
+  log.info(f'Generating table for {server}')
+
+  catalog = utilrsw.get_path(server_meta, 'catalog/catalog', sep='/')
+  if catalog is None:
+    log.error(f'Could not find catalog for server: {server}. Skipping server.')
+    return rows
 
-    if max_datasets is not None:
-      catalog = catalog[:max_datasets]
+  if max_datasets is not None:
+    catalog = catalog[:max_datasets]
 
-    for dataset in catalog:
-      dataset['server'] = server
-      dataset['dataset'] = dataset['id']
-      del dataset['id']
+  # Parse all times with one call per time format; normalize_datetime()
+  # then gets them from the cache.
+  times = []
+  for dataset in catalog:
+    times.append(str(utilrsw.get_path(dataset, 'info.startDate', '')).strip())
+    times.append(str(utilrsw.get_path(dataset, 'info.stopDate', '')).strip())
+  hapimeta.hapitime.parse_batch(times)
 
-      utilrsw.rm_paths(dataset, omits, sep='/', ignore_error=True)
+  for dataset in catalog:
+    dataset['server'] = server
+    dataset['dataset'] = dataset['id']
+    del dataset['id']
 
-      if utilrsw.get_path(dataset, ['info', 'additionalMetadata']) is not None:
-        if isinstance(dataset['info']['additionalMetadata'], dict):
-          continue
+    utilrsw.rm_paths(dataset, omits, sep='/', ignore_error=True)
 
-      parameters = utilrsw.get_path(dataset, ['info', 'parameters'])
-      if parameters is None:
-        msg = 'Could not find parameters for dataset: '
-        msg += f"{server}/{dataset['dataset']}. Skipping dataset."
-        log.error(msg)
+    if utilrsw.get_path(dataset, ['info', 'additionalMetadata']) is not None:
+      if isinstance(dataset['info']['additionalMetadata'], dict):
         continue
 
-      dataset['x_nParams'] = len(parameters)
-      startDate = utilrsw.get_path(dataset, 'info.startDate', '')
-      stopDate = utilrsw.get_path(dataset, 'info.stopDate', '')
-      dataset['x_startDate'] = normalize_datetime(startDate)
-      dataset['x_stopDate'] = normalize_datetime(stopDate)
-      for parameter in parameters:
-        parameter['parameter'] = parameter['name']
-        del parameter['name']
-        if 'units' in parameter and parameter['units'] is None:
-          parameter['units'] = ''
-        parameter = {
-          'server': server,
-          'dataset': dataset['dataset'],
-          'startDate': startDate,
-          'x_startDate': normalize_datetime(startDate),
-          'stopDate': stopDate,
-          'x_stopDate': normalize_datetime(stopDate),
-          'cadence': utilrsw.get_path(dataset, 'info.cadence', ''),
-          **parameter
-        }
-
-        if 'bins' in parameter:
-          if isinstance(parameter['bins'], list):
-            try:
-              parameter['bins'] = format_bins(parameter['bins'])
-            except Exception as exc:
-              msg = 'Error formatting bins for parameter: '
-              msg += f"{server}/{dataset['dataset']}/{parameter['parameter']}. Error: {exc}"
-              log.error(msg)
-
-        row = utilrsw.flatten_dicts(parameter, simplify=True)
-        rows['parameter'].append(reorder_keys(row))
-
-      row = utilrsw.flatten_dicts(dataset, simplify=True)
-      rows['dataset'].append(reorder_keys(row))
+    parameters = utilrsw.get_path(dataset, ['info', 'parameters'])
+    if parameters is None:
+      msg = 'Could not find parameters for dataset: '
+      msg += f"{server}/{dataset['dataset']}. Skipping dataset."
+      log.error(msg)
+      continue
+
+    dataset['x_nParams'] = len(parameters)
+    startDate = utilrsw.get_path(dataset, 'info.startDate', '')
+    stopDate = utilrsw.get_path(dataset, 'info.stopDate', '')
+    x_startDate = normalize_datetime(startDate)
+    x_stopDate = normalize_datetime(stopDate)
+    dataset['x_startDate'] = x_startDate
+    dataset['x_stopDate'] = x_stopDate
+    for parameter in parameters:
+      parameter['parameter'] = parameter['name']
+      del parameter['name']
+      if 'units' in parameter and parameter['units'] is None:
+        parameter['units'] = ''
+      parameter = {
+        'server': server,
+        'dataset': dataset['dataset'],
+        'startDate': startDate,
+        'x_startDate': x_startDate,
+        'stopDate': stopDate,
+        'x_stopDate': x_stopDate,
+        'cadence': utilrsw.get_path(dataset, 'info.cadence', ''),
+        **parameter
+      }
+
+      if 'bins' in parameter:
+        if isinstance(parameter['bins'], list):
+          try:
+            parameter['bins'] = format_bins(parameter['bins'])
+          except Exception as exc:
+            msg = 'Error formatting bins for parameter: '
+            msg += f"{server}/{dataset['dataset']}/{parameter['parameter']}. Error: {exc}"
+            log.error(msg)
+
+      row = utilrsw.flatten_dicts(parameter, simplify=True)
+      rows['parameter'].append(reorder_keys(row))
+
+    row = utilrsw.flatten_dicts(dataset, simplify=True)
+    rows['dataset'].append(reorder_keys(row))
+
 
   return rows
 
 
+def server_hashes(all, max_datasets=None):
+  """
+  Return {server: sha256} of the content of each server's catalog that
+  reaches its rows (the entries of catalog/catalog, each with its info, but
+  not, e.g., catalog/x_LastUpdate, which changes in every run) and the table
+  configuration. Used to find the servers whose rows need to be updated.
+  """
+  import json
+  import hashlib
+
+  settings = {
+    'version': hapimeta.__version__,
+    'dicts2table': cfg['dicts2table'],
+    'omits': cfg['omits'],
+    'normalize': cfg.get('normalize', {}),
+    'max_datasets': max_datasets
+  }
+  settings = json.dumps(settings, sort_keys=True)
+
+  hashes = {}
+  for server in all:
+    catalog = utilrsw.get_path(all[server], 'catalog/catalog', sep='/')
+    if hasattr(all, 'release'):
+      all.release(server)
+    content = json.dumps(catalog, sort_keys=True, default=str)
+    content = f'{content}\n{settings}'
+    hashes[server] = hashlib.sha256(content.encode('utf-8')).hexdigest()
+  return hashes
+
+
+def update(all, args, hashes, batch_rows, workers=1):
+  """
+  Update the table files in place. Rows are only computed for servers whose
+  hash differs from that stored in a file, and rows of servers no longer in
+  all are removed (only if all servers were requested). Returns False if a
+  table file does not exist.
+  """
+  import os
+
+  config = cfg['dicts2table']
+  normalize = cfg.get('normalize', {})
+  fnames = {}
+  stored = {}
+  for kind in config:
+    fnames[kind] = os.path.join(config[kind]['out_dir'], f"{config[kind]['name']}.sql")
+    stored[kind] = hapimeta.tabledb.read_hashes(fnames[kind])
+    if stored[kind] is None:
+      log.info(f'{fnames[kind]} not found. Writing all rows.')
+      return False
+    if hapimeta.tabledb.normalized(fnames[kind], config[kind]['name']) != (kind in normalize):
+      log.info(f'Layout of {fnames[kind]} differs from normalize in run.json. Writing all rows.')
+      return False
+
+  changed = [server for server in all if any(stored[kind].get(server) != hashes[server] for kind in config)]
+  removed = []
+  if args.servers is None and args.n_servers is None:
+    removed = sorted(set(server for kind in config for server in stored[kind] if server not in hashes))
+
+  msg = f'{len(all) - len(changed)}/{len(all)} servers unchanged. '
+  msg += f'Updating rows for {len(changed)} and removing rows for {len(removed)}.'
+  log.info(msg)
+  if len(changed) > 0 or len(removed) > 0:
+    _update(all, args, fnames, changed, removed, hashes, batch_rows, workers)
+
+  # Also creates indexes missing from files written before they were
+  # configured.
+  indexes = cfg.get('indexes', {})
+  for kind in config:
+    hapimeta.tabledb.optimize(fnames[kind], indexes.get(kind), log)
+
+  return True
+
+
+def _update(all, args, fnames, changed, removed, hashes, batch_rows, workers):
+  import shutil
+  import tempfile
+
+  config = cfg['dicts2table']
+  tmp_dirs = {kind: tempfile.mkdtemp(prefix='.update.', dir=config[kind]['out_dir']) for kind in config}
+  try:
+    writers = {}
+    if len(changed) > 0:
+      for kind in config:
+        config_part = {**config[kind], 'out_dir': tmp_dirs[kind]}
+        normalize = cfg.get('normalize', {}).get(kind)
+        writers[kind] = hapimeta.tabledb.TableWriter(config_part, log, batch_rows=batch_rows, normalize=normalize)
+      all_changed = all.subset(changed)
+      workers = min(workers, len(changed))
+      for server, rows in iter_rows(all_changed, omits=cfg['omits'], max_datasets=args.n_datasets, workers=workers):
+        for kind, writer in writers.items():
+          writer.add(rows[kind])
+
+    for kind in config:
+      fname_part = None
+      if kind in writers:
+        writers[kind].close()
+        fname_part = writers[kind].fname
+      log.info(f'Updating {fnames[kind]}')
+      hapimeta.tabledb.update(fnames[kind], fname_part, changed + removed, hashes, log)
+      if kind in writers:
+        # Other files dicts2table() wrote, as for a full build.
+        hapimeta.tabledb.move_files(tmp_dirs[kind], config[kind]['out_dir'], config[kind]['name'])
+  finally:
+    for tmp_dir in tmp_dirs.values():
+      shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
 def run():
   log.info('Generating table')
   args = hapimeta.cli()
   all = hapimeta.all(log)
 
-  rows = compute_rows(all, omits=cfg['omits'], max_datasets=args.n_datasets)
+  batch_rows = cfg.get('batch_rows', 50000)
+  hashes = server_hashes(all, max_datasets=args.n_datasets)
+
+  workers = args.workers if args.workers is not None else cfg.get('workers', 1)
+  workers = min(workers, max(1, len(all)))
+
+  if args.incremental or cfg.get('incremental', False):
+    if update(all, args, hashes, batch_rows, workers=workers):
+      return
+
+  build(all, args, hashes, batch_rows, workers=workers)
 
+
+def build(all, args, hashes, batch_rows, workers=1):
+  """Write the table files with the rows of all servers in all."""
+
+  # Rows are written in batches as servers are processed instead of after
+  # the rows for all servers are computed.
   config = cfg['dicts2table']
-  tableui.dicts2table(rows['dataset'], config['dataset'], logger=log)
-  tableui.dicts2table(rows['parameter'], config['parameter'], logger=log)
+  indexes = cfg.get('indexes', {})
+  normalize = cfg.get('normalize', {})
+  writers = {}
+  for kind in ['dataset', 'parameter']:
+    writers[kind] = hapimeta.tabledb.TableWriter(config[kind], log, batch_rows=batch_rows,
+                                                 indexes=indexes.get(kind), normalize=normalize.get(kind))
+
+  for server, rows in iter_rows(all, omits=cfg['omits'], max_datasets=args.n_datasets, workers=workers):
+    for kind, writer in writers.items():
+      writer.add(rows[kind])
+
+  for writer in writers.values():
+    writer.close(hashes=hashes)
 
 
 if __name__ == '__main__':
-  run()
\ No newline at end of file
+  run()
@@ -7,22 +7,12 @@ def get(url, log=None, timeout=20, retries=3, indent=''):
   # TODO: Handle log=None
 
   import json
-  import requests
-  from requests.adapters import HTTPAdapter
-  from requests.packages.urllib3.util.retry import Retry
-
-  retries = Retry(total=retries, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
 
   log.info(f'{indent}Getting {url}')
-  user_agent = f'hapibot-mirror/{hapimeta.__version__}; '
-  user_agent += 'https://github.com/hapi-server/data-specification/wiki/hapi-bots.md#hapibot-mirror'
-  headers = {'User-Agent': user_agent}
-  session = requests.Session()
-  session.mount('http://', HTTPAdapter(max_retries=retries))
-  session.mount('https://', HTTPAdapter(max_retries=retries))
+  session = hapimeta.sessions.session(url, retries=retries)
 
   try:
-    response = session.get(url, headers=headers, timeout=timeout)
+    response = session.get(url, timeout=timeout)
     response.raise_for_status()
   except Exception as exc:
     log.error(f'{indent}Error: {exc}')
@@ -34,4 +24,48 @@ def get(url, log=None, timeout=20, retries=3, indent=''):
   except json.JSONDecodeError as exc:
     log.error(f'{indent}Error parsing JSON from {url}:\n  {exc}')
     raise exc
-  return data
\ No newline at end of file
+  return data
+
+
+async def aget(session, url, log=None, timeout=20, retries=3, indent=''):
+  """
+  Asynchronous version of get() that uses an aiohttp.ClientSession.
+
+  Requests that fail with a connection error or a 500, 502, 503, or 504
+  status are retried up to retries times with exponential backoff.
+  """
+
+  assert log is not None, 'log keyword argument must be provided'
+
+  import json
+  import asyncio
+  import aiohttp
+
+  status_forcelist = [500, 502, 503, 504]
+  client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+  log.info(f'{indent}Getting {url}')
+  attempt = 0
+  while True:
+    try:
+      async with session.get(url, timeout=client_timeout) as response:
+        response.raise_for_status()
+        text = await response.text()
+      break
+    except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+      retry = attempt < retries
+      if isinstance(exc, aiohttp.ClientResponseError) and exc.status not in status_forcelist:
+        retry = False
+      if not retry:
+        log.error(f'{indent}Error: {exc}')
+        raise exc
+      await asyncio.sleep(0.5 * 2**attempt)
+      attempt += 1
+  log.info(f'{indent}Got {url}')
+
+  try:
+    data = json.loads(text)
+  except json.JSONDecodeError as exc:
+    log.error(f'{indent}Error parsing JSON from {url}:\n  {exc}')
+    raise exc
+  return data
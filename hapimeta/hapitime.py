@@ -0,0 +1,123 @@
+import threading
+import collections
+
+
+def parse(time_str, allow_missing_Z=False):
+  """
+  Return hapiclient.hapitime2datetime(time_str, allow_missing_Z)[0].
+
+  Results, including failures, are kept in a bounded LRU cache shared by all
+  generators in the process, so a string that appears many times (e.g., the
+  startDate of a dataset, which the table generator uses for every
+  parameter) is only parsed once. Raises ValueError if time_str can not be
+  parsed.
+  """
+  key = (time_str, allow_missing_Z)
+  with parse.lock:
+    if key in parse.cache:
+      parse.cache.move_to_end(key)
+      parse.hits += 1
+      value = parse.cache[key]
+    else:
+      value = None
+
+  if value is None:
+    try:
+      value = _parse([time_str], allow_missing_Z)[0]
+    except Exception as exc:
+      value = _Error(f'{type(exc).__name__}: {exc}')
+    _store({key: value})
+
+  if isinstance(value, _Error):
+    raise ValueError(value.message)
+  return value
+
+parse.cache = collections.OrderedDict()
+parse.lock = threading.Lock()
+parse.maxsize = 100000
+parse.hits = 0
+parse.misses = 0
+
+
+def parse_batch(time_strs, allow_missing_Z=False):
+  """
+  Return a list with parse(time_str, allow_missing_Z) for each of time_strs,
+  with None for strings that can not be parsed.
+
+  Strings that are not cached are parsed with one hapitime2datetime() call
+  for each distinct format (hapitime2datetime() determines the format from
+  the first element of an array), instead of one call per string.
+  """
+  import re
+
+  results = {}
+  with parse.lock:
+    for time_str in time_strs:
+      key = (time_str, allow_missing_Z)
+      if key in parse.cache:
+        parse.cache.move_to_end(key)
+        parse.hits += 1
+        results[time_str] = parse.cache[key]
+
+  groups = {}
+  for time_str in time_strs:
+    if time_str in results or not isinstance(time_str, str):
+      continue
+    # Strings with the same pattern of digits and separators have the same
+    # format, e.g., 2000-01-01T00:00Z and 2001-02-03T04:05Z.
+    groups.setdefault(re.sub(r'\d', '0', time_str), {})[time_str] = None
+
+  new = {}
+  for group in groups.values():
+    group = list(group.keys())
+    try:
+      values = _parse(group, allow_missing_Z)
+    except Exception:
+      values = None
+    if values is None or len(values) != len(group):
+      # Parse individually so that one bad string does not fail the group.
+      for time_str in group:
+        try:
+          new[time_str] = _parse([time_str], allow_missing_Z)[0]
+        except Exception as exc:
+          new[time_str] = _Error(f'{type(exc).__name__}: {exc}')
+    else:
+      for time_str, value in zip(group, values):
+        new[time_str] = value
+
+  _store({(time_str, allow_missing_Z): value for time_str, value in new.items()})
+  results.update(new)
+
+  out = []
+  for time_str in time_strs:
+    value = results.get(time_str) if isinstance(time_str, str) else None
+    out.append(None if isinstance(value, _Error) else value)
+  return out
+
+
+def cache_info():
+  """Return a dict with the number of hits, misses, and cached strings."""
+  with parse.lock:
+    return {'hits': parse.hits, 'misses': parse.misses, 'size': len(parse.cache)}
+
+
+class _Error:
+  # Cached result for a string that could not be parsed.
+  def __init__(self, message):
+    self.message = message
+
+
+def _parse(time_strs, allow_missing_Z):
+  import numpy
+  import hapiclient
+
+  times = numpy.array(time_strs)
+  return list(hapiclient.hapitime2datetime(times, allow_missing_Z=allow_missing_Z))
+
+
+def _store(values):
+  with parse.lock:
+    parse.misses += len(values)
+    parse.cache.update(values)
+    while len(parse.cache) > parse.maxsize:
+      parse.cache.popitem(last=False)
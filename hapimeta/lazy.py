@@ -0,0 +1,84 @@
+import threading
+
+
+def lazy(factory, *args):
+  """
+  Return a proxy for factory(*args) that only calls factory when the proxy
+  is first used.
+
+  Generators use this for their module-level cfg and log so that importing
+  a generator (e.g., to list commands or print --help) does not read
+  run.json or create log files.
+
+  The proxy supports attribute access, item access, iteration, len(), and
+  bool(). It is not an instance of the proxied object's class, so use
+  resolve() where the object itself is needed (e.g., json.dumps(resolve(cfg))
+  or isinstance checks). Pickling a proxy pickles factory and args (so a
+  proxy passed to another process creates its own object when used), and
+  copy.copy() and copy.deepcopy() return copies of the object.
+  """
+  return Lazy(factory, *args)
+
+
+def resolve(obj):
+  """Return the object proxied by obj if obj is a lazy() proxy, else obj."""
+  if isinstance(obj, Lazy):
+    return obj._get()
+  return obj
+
+
+class Lazy:
+
+  def __init__(self, factory, *args):
+    self._factory = factory
+    self._args = args
+    self._object = None
+    self._created = False
+    self._lock = threading.Lock()
+
+  def _get(self):
+    if not self._created:
+      with self._lock:
+        if not self._created:
+          self._object = self._factory(*self._args)
+          self._created = True
+    return self._object
+
+  def __getattr__(self, name):
+    # Only called for attributes not set in __init__. The check avoids
+    # infinite recursion if used before __init__ runs (e.g., by copy).
+    if name in ('_factory', '_args', '_object', '_created', '_lock'):
+      raise AttributeError(name)
+    return getattr(self._get(), name)
+
+  def __reduce__(self):
+    return (Lazy, (self._factory, *self._args))
+
+  def __copy__(self):
+    import copy
+    return copy.copy(self._get())
+
+  def __deepcopy__(self, memo):
+    import copy
+    return copy.deepcopy(self._get(), memo)
+
+  def __getitem__(self, key):
+    return self._get()[key]
+
+  def __setitem__(self, key, value):
+    self._get()[key] = value
+
+  def __contains__(self, key):
+    return key in self._get()
+
+  def __iter__(self):
+    return iter(self._get())
+
+  def __len__(self):
+    return len(self._get())
+
+  def __bool__(self):
+    return bool(self._get())
+
+  def __repr__(self):
+    return repr(self._get())
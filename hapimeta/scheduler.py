@@ -0,0 +1,92 @@
+import threading
+
+
+def run(tasks, func, max_workers=10, max_per_key=None, on_key_done=None, log=None):
+  """
+  Run func(key, task) for all tasks using a pool of max_workers threads.
+
+  tasks is a dict of lists of tasks, e.g., {server_id: [task1, task2, ...]}.
+  Keys are served in the order of the dict: an idle worker takes the next
+  task of the first key that has tasks waiting and fewer than max_per_key
+  tasks running. So work for the first (largest) keys starts first and
+  workers that would otherwise be idle take tasks from keys that still have
+  work instead of waiting for one thread per key to finish.
+
+  func may return a list of additional tasks for the same key, which are
+  queued behind the key's remaining tasks and run by any idle worker.
+
+  on_key_done(key) is called once, by the worker that finished the last task
+  for key, or immediately for keys with no tasks. Exceptions raised by func
+  or on_key_done are logged with the key.
+  """
+  import collections
+
+  pending = {key: collections.deque(key_tasks) for key, key_tasks in tasks.items()}
+  running = {key: 0 for key in tasks.keys()}
+  cond = threading.Condition()
+
+  if max_per_key is None:
+    max_per_key = max_workers
+
+  def key_done(key):
+    # An exception in on_key_done must not stop the worker or be reported
+    # as a failure of one of the key's tasks.
+    if on_key_done is None:
+      return
+    try:
+      on_key_done(key)
+    except Exception as exc:
+      if log is not None:
+        log.error(f'Uncaught exception in on_key_done for {key}: {exc}')
+
+  for key in tasks.keys():
+    if len(pending[key]) == 0:
+      key_done(key)
+
+  def next_task():
+    # Must be called with cond held.
+    for key in pending.keys():
+      if len(pending[key]) > 0 and running[key] < max_per_key:
+        running[key] += 1
+        return key, pending[key].popleft()
+    return None, None
+
+  def finished():
+    # Must be called with cond held.
+    return all(len(pending[key]) == 0 and running[key] == 0 for key in pending.keys())
+
+  def worker():
+    while True:
+      with cond:
+        key, task = next_task()
+        while key is None:
+          if finished():
+            return
+          cond.wait()
+          key, task = next_task()
+
+      new_tasks = None
+      try:
+        new_tasks = func(key, task)
+      except Exception as exc:
+        if log is not None:
+          log.error(f'Uncaught exception for {key}: {exc}')
+
+      with cond:
+        if new_tasks:
+          pending[key].extend(new_tasks)
+        running[key] -= 1
+        done = len(pending[key]) == 0 and running[key] == 0
+        cond.notify_all()
+
+      if done:
+        key_done(key)
+
+  # All max_workers threads are started even if there are fewer tasks, since
+  # func may return tasks (e.g., one task per server that returns a task per
+  # dataset); threads wait for tasks and exit when all tasks are finished.
+  threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, max_workers))]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
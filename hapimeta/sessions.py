@@ -0,0 +1,109 @@
+import threading
+
+import hapimeta
+
+
+def session(url, retries=3):
+  """
+  Return the process-wide requests.Session for the scheme and host of url.
+
+  A session (and its connection pool) is created on the first request to a
+  host and reused for all later requests to it, so that repeated /info
+  requests do not each pay for a new TCP and TLS handshake. Sessions are
+  safe to share between the threads used by the catalogs generator.
+  """
+  import urllib.parse
+
+  parts = urllib.parse.urlsplit(url)
+  key = (parts.scheme, parts.netloc, retries)
+
+  with session.lock:
+    if key not in session.sessions:
+      session.sessions[key] = _new_session(retries)
+    return session.sessions[key]
+
+session.sessions = {}
+session.lock = threading.Lock()
+session.pool_maxsize = 10
+
+
+def configure(pool_maxsize=None):
+  """
+  Set the connection pool size used for sessions created after this call.
+
+  The pool size should be at least the number of threads that can request
+  from the same host at the same time; otherwise connections are discarded
+  after use instead of being returned to the pool.
+  """
+  if pool_maxsize is not None:
+    session.pool_maxsize = max(1, int(pool_maxsize))
+
+
+def stats():
+  """
+  Return connection counters for each host with a session.
+
+  Returns a dict of the form
+    {'https://host': {'requests': int, 'connections': int, 'reused': int}}
+  where 'reused' is the number of requests that did not need a new connection.
+  """
+
+  totals = {}
+  with session.lock:
+    items = list(session.sessions.items())
+
+  for (scheme, netloc, _), sess in items:
+    host = f'{scheme}://{netloc}'
+    if host not in totals:
+      totals[host] = {'requests': 0, 'connections': 0, 'reused': 0}
+    for adapter in set(sess.adapters.values()):
+      pools = adapter.poolmanager.pools
+      for pool_key in pools.keys():
+        pool = pools.get(pool_key)
+        if pool is None:
+          continue
+        totals[host]['requests'] += pool.num_requests
+        totals[host]['connections'] += pool.num_connections
+
+  for counts in totals.values():
+    counts['reused'] = max(0, counts['requests'] - counts['connections'])
+
+  return totals
+
+
+def log_stats(log):
+  counts = stats()
+  if not counts:
+    return
+  log.info('Connection reuse:')
+  for host in sorted(counts.keys()):
+    c = counts[host]
+    log.info(f"  {host}: {c['requests']} requests, {c['connections']} connections, {c['reused']} reused")
+
+
+def user_agent():
+  user_agent = f'hapibot-mirror/{hapimeta.__version__}; '
+  user_agent += 'https://github.com/hapi-server/data-specification/wiki/hapi-bots.md#hapibot-mirror'
+  return user_agent
+
+
+def _new_session(retries):
+  import requests
+  from requests.adapters import HTTPAdapter
+  from requests.packages.urllib3.util.retry import Retry
+
+  retries = Retry(total=retries, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
+
+  sess = requests.Session()
+  sess.headers.update({'User-Agent': user_agent()})
+
+  # One pool per adapter is enough because a session only talks to one host.
+  kwargs = {
+    'max_retries': retries,
+    'pool_connections': 1,
+    'pool_maxsize': session.pool_maxsize
+  }
+  sess.mount('http://', HTTPAdapter(**kwargs))
+  sess.mount('https://', HTTPAdapter(**kwargs))
+
+  return sess
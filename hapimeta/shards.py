@@ -0,0 +1,342 @@
+import threading
+import collections.abc
+
+INDEX_FILE = 'index.json'
+
+# Unpickled shards shared by readonly Shards, keyed by sha256 of the shard.
+_decoded = {}
+
+
+def write(catalogs, out_dir, log):
+  """
+  Write catalogs (the content of catalogs-all.pkl) as one pickle file per
+  server in out_dir and an index file, out_dir/index.json, of the form
+    {server_id: {'file': str, 'size': int, 'sha256': str, 'content': str}, ...}
+  where sha256 is that of the file and content is content_hash() of the
+  server's content. The index is written last so that readers never see an
+  index that refers to shards that have not been written.
+  """
+  import os
+  import json
+  import pickle
+  import hashlib
+
+  os.makedirs(out_dir, exist_ok=True)
+
+  index = {}
+  for server_id, server_meta in catalogs.items():
+    data = pickle.dumps(server_meta, protocol=pickle.HIGHEST_PROTOCOL)
+    file = _file_name(server_id)
+    log.info(f'Writing {os.path.join(out_dir, file)}')
+    _write_atomic(os.path.join(out_dir, file), data)
+    index[server_id] = {
+      'file': file,
+      'size': len(data),
+      'sha256': hashlib.sha256(data).hexdigest(),
+      'content': content_hash(server_meta)
+    }
+
+  fname = os.path.join(out_dir, INDEX_FILE)
+  log.info(f'Writing {fname}')
+  _write_atomic(fname, json.dumps(index, indent=2).encode('utf-8'))
+
+  files = set(entry['file'] for entry in index.values())
+  for file in os.listdir(out_dir):
+    if file.endswith('.pkl') and file not in files:
+      log.info(f'Removing {os.path.join(out_dir, file)} because server not in index.')
+      os.remove(os.path.join(out_dir, file))
+
+  return index
+
+
+def content_hash(server_meta):
+  """
+  Return the sha256 of server_meta without the x_LastUpdate* attributes
+  (e.g., x_LastUpdate and x_LastUpdateAttempt), which change in every run
+  of the catalogs command even if nothing else does.
+  """
+  import json
+  import hashlib
+
+  def stable(x):
+    if isinstance(x, dict):
+      return {key: stable(value) for key, value in x.items() if not str(key).startswith('x_LastUpdate')}
+    if isinstance(x, (list, tuple)):
+      return [stable(value) for value in x]
+    return x
+
+  content = json.dumps(stable(server_meta), sort_keys=True, default=str)
+  return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def read_index(shard_dir):
+  """Return the index in shard_dir or None if it does not exist."""
+  import os
+  import json
+
+  fname = os.path.join(shard_dir, INDEX_FILE)
+  if not os.path.exists(fname):
+    return None
+  with open(fname) as fin:
+    return json.load(fin)
+
+
+def sync(url, shard_dir, index_remote, server_ids, log, max_workers=8):
+  """
+  Make the shards for server_ids in shard_dir match those listed in
+  index_remote, the index at url.
+
+  Only shards that are missing locally or whose content hash (see
+  content_hash()) differs from that in index_remote are downloaded (in
+  parallel), so a shard whose only change is in x_LastUpdate* attributes is
+  not downloaded. Each download is checked against the sha256 of the file in
+  index_remote before it replaces the local file.
+
+  If a download fails, the local shard from an earlier download is used if
+  it exists (with a warning). If there is none, RuntimeError is raised so
+  that output is not generated without the server.
+
+  Returns an index with the servers in server_ids, in the same order, with
+  the local entry for shards that were not downloaded.
+  """
+  import os
+  import json
+  import hashlib
+  import urllib.parse
+  import concurrent.futures
+
+  import hapimeta
+
+  os.makedirs(shard_dir, exist_ok=True)
+  index_local = read_index(shard_dir) or {}
+
+  def current(server_id):
+    entry = index_local.get(server_id)
+    if entry is None:
+      return False
+    # Indexes written before the content hash was added only have sha256.
+    key = 'content' if 'content' in entry and 'content' in index_remote[server_id] else 'sha256'
+    if entry[key] != index_remote[server_id][key]:
+      return False
+    fname = os.path.join(shard_dir, entry['file'])
+    return os.path.exists(fname) and os.path.getsize(fname) == entry['size']
+
+  def download(server_id):
+    entry = index_remote[server_id]
+    file_url = f"{url}/{urllib.parse.quote(entry['file'])}"
+    log.info(f'  Getting {file_url}')
+    session = hapimeta.sessions.session(file_url)
+    response = session.get(file_url, timeout=60)
+    response.raise_for_status()
+    data = response.content
+    if hashlib.sha256(data).hexdigest() != entry['sha256']:
+      raise ValueError(f'sha256 of {file_url} does not match that in {url}/{INDEX_FILE}')
+    _write_atomic(os.path.join(shard_dir, entry['file']), data)
+
+  stale = [server_id for server_id in server_ids if not current(server_id)]
+  n_current = len(server_ids) - len(stale)
+  log.info(f'{n_current}/{len(server_ids)} shards in {shard_dir} are current. Downloading {len(stale)}.')
+
+  synced = []
+  with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+    futures = {pool.submit(download, server_id): server_id for server_id in stale}
+    for future in concurrent.futures.as_completed(futures):
+      server_id = futures[future]
+      try:
+        future.result()
+        synced.append(server_id)
+      except Exception as exc:
+        log.error(f'  Error getting shard for {server_id}: {exc}')
+
+  fallback = {}
+  for server_id in stale:
+    if server_id in synced:
+      continue
+    entry = index_local.get(server_id)
+    if entry is None:
+      continue
+    fname = os.path.join(shard_dir, entry['file'])
+    if os.path.exists(fname) and os.path.getsize(fname) == entry['size']:
+      log.warning(f'  Using shard for {server_id} from an earlier download: {fname}')
+      fallback[server_id] = entry
+
+  # Entries for servers that were not requested are kept so that their shards
+  # are not downloaded again if they have not changed.
+  for server_id in synced:
+    index_local[server_id] = index_remote[server_id]
+  for server_id in stale:
+    if server_id not in synced and server_id not in fallback and server_id in index_local:
+      del index_local[server_id]
+  _write_atomic(os.path.join(shard_dir, INDEX_FILE), json.dumps(index_local, indent=2).encode('utf-8'))
+
+  missing = [server_id for server_id in stale if server_id not in synced and server_id not in fallback]
+  if len(missing) > 0:
+    msg = f"Could not get shards for {', '.join(missing)} from {url} and no earlier download exists."
+    log.error(msg)
+    raise RuntimeError(msg)
+
+  # The local entry of a shard that was not downloaded has the sha256 of the
+  # local file, which differs from that in index_remote if only its
+  # x_LastUpdate* attributes changed.
+  return {server_id: index_local[server_id] for server_id in server_ids}
+
+
+class Shards(collections.abc.Mapping):
+  """
+  Read-only mapping of server_id to the server's catalogs-all content.
+
+  Only the index is read when created; a server's shard is read and
+  unpickled the first time it is accessed.
+
+  Shard bytes are read from disk once per process (see read()) and are never
+  modified, so generators run in the same process (e.g., by run.py) share
+  them. By default, each Shards unpickles its own copy of a server's content,
+  which the caller may modify without affecting other generators. If
+  readonly=True, one unpickled copy is shared by all readonly Shards in the
+  process and must not be modified. release() drops the Shards' reference
+  and the shared copy.
+  """
+
+  def __init__(self, shard_dir, index, log=None, readonly=False, content=None):
+    self._shard_dir = shard_dir
+    self._index = index
+    self._log = log
+    self._readonly = readonly
+    self._content = content
+    self._loaded = {}
+
+  @classmethod
+  def from_dict(cls, all, log=None, readonly=False):
+    """
+    Create from a dict with the content of catalogs-all.pkl, which is used
+    as is (not copied) by readonly Shards and copied when a server is first
+    accessed otherwise.
+    """
+    index = {server_id: {'file': None} for server_id in all}
+    return cls(None, index, log=log, readonly=readonly, content=all)
+
+  def __getitem__(self, server_id):
+    if server_id not in self._index:
+      raise KeyError(server_id)
+    if server_id not in self._loaded:
+      self._loaded[server_id] = self._load(server_id)
+    return self._loaded[server_id]
+
+  def __iter__(self):
+    return iter(self._index)
+
+  def __len__(self):
+    return len(self._index)
+
+  def sha256(self, server_id):
+    """
+    Return the sha256 of server_id's shard (without reading it) or None if
+    created with from_dict().
+    """
+    return self._index[server_id].get('sha256')
+
+  def release(self, server_id):
+    """
+    Drop this Shards' reference to server_id's content, and the copy shared
+    by readonly Shards, to free memory.
+    """
+    self._loaded.pop(server_id, None)
+    if self._readonly and self._content is None:
+      _decoded.pop(self._index[server_id]['sha256'], None)
+
+  def subset(self, server_ids):
+    """Return a Shards with only server_ids (in the order of the index)."""
+    index = {key: value for key, value in self._index.items() if key in server_ids}
+    return Shards(self._shard_dir, index, log=self._log, readonly=self._readonly, content=self._content)
+
+  def view(self, readonly=False):
+    """Return a Shards for the same servers with its own unpickled copies."""
+    return Shards(self._shard_dir, self._index, log=self._log, readonly=readonly, content=self._content)
+
+  def raw(self, server_id):
+    """
+    Return the pickled content of server_id without unpickling it, e.g., to
+    pass it to another process.
+    """
+    import pickle
+
+    if server_id not in self._index:
+      raise KeyError(server_id)
+    if self._content is not None:
+      return pickle.dumps(self._content[server_id], protocol=pickle.HIGHEST_PROTOCOL)
+    return self._read(server_id)
+
+  def _load(self, server_id):
+    import pickle
+
+    if self._content is not None:
+      if self._readonly:
+        return self._content[server_id]
+      # A pickle round trip copies faster than copy.deepcopy().
+      return pickle.loads(self.raw(server_id))
+
+    sha256 = self._index[server_id]['sha256']
+    if self._readonly and sha256 in _decoded:
+      return _decoded[sha256]
+
+    server_meta = pickle.loads(self.raw(server_id))
+    if self._readonly:
+      _decoded[sha256] = server_meta
+    return server_meta
+
+  def _read(self, server_id):
+    import os
+    import hashlib
+
+    entry = self._index[server_id]
+    fname = os.path.join(self._shard_dir, entry['file'])
+    data = read(fname, log=self._log)
+
+    if hashlib.sha256(data).hexdigest() != entry['sha256']:
+      msg = f'sha256 of {fname} does not match that in {INDEX_FILE}. '
+      msg += "Re-run 'python run.py catalogs'."
+      if self._log is not None:
+        self._log.error(msg)
+      raise ValueError(msg)
+
+    return data
+
+
+def read(fname, log=None):
+  """
+  Return the bytes in fname. The file is only read again if its modification
+  time or size changed since the last read in this process.
+  """
+  import os
+
+  stat = os.stat(fname)
+  key = (stat.st_mtime_ns, stat.st_size)
+  with read.lock:
+    if fname in read.cache and read.cache[fname][0] == key:
+      return read.cache[fname][1]
+
+  if log is not None:
+    log.info(f'Reading {fname}')
+  with open(fname, 'rb') as fin:
+    data = fin.read()
+
+  with read.lock:
+    read.cache[fname] = (key, data)
+  return data
+
+read.cache = {}
+read.lock = threading.Lock()
+
+
+def _file_name(server_id):
+  import urllib.parse
+  return f"{urllib.parse.quote(server_id, safe='')}.pkl"
+
+
+def _write_atomic(fname, data):
+  import os
+
+  tmp = f'{fname}.tmp'
+  with open(tmp, 'wb') as fout:
+    fout.write(data)
+  os.replace(tmp, fname)
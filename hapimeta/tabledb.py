@@ -0,0 +1,546 @@
+import os
+
+# Table with the hash of each server's content (see table.server_hashes())
+# when its rows were written.
+SERVERS_TABLE = '_hapimeta_servers'
+
+# Column with the integer key of a row's dataset in normalized tables (see
+# TableWriter).
+KEY = 'x_datasetKey'
+
+
+class TableWriter:
+  """
+  Write rows with tableui.dicts2table() in batches of at most batch_rows.
+
+  config is a dicts2table configuration (e.g., table.dicts2table.dataset in
+  run.json). Rows passed to add() are buffered; when the buffer has
+  batch_rows rows, it is written with dicts2table() to a temporary SQLite
+  file that is merged into that of the first batch with append(). Columns
+  that first occur in a later batch are added after the existing columns.
+  Other files dicts2table() writes are kept from the first batch that
+  writes them; a warning is logged if a later batch writes a different
+  version. If batch_rows is None, all rows are written with a single call
+  to dicts2table(), as when the rows are not batched.
+
+  close() moves the files to out_dir, with out_dir/name.sql last, which is
+  written with replace(), so the file tableui-serve reads is replaced at
+  once. If close() is given {server: sha256}, it is stored in the file for
+  use by update(). If indexes is given, optimize() is applied to the file
+  before it is moved.
+
+  If normalize is a list of columns (e.g., server, dataset, startDate), rows
+  are written in a normalized layout: the values of these columns, which are
+  the same for all rows of a dataset, are written once per dataset to table
+  NAME_datasets, and the other columns to table NAME_rows, with a column
+  x_datasetKey in both. Keys are assigned to datasets in the order their
+  first row is added (1, 2, ...), so the rows of the view NAME, which joins
+  the tables, are in the order they were added whether SQLite reads the
+  view in the order of NAME_rows or of NAME_datasets. The view has the
+  columns of the rows as given (in the order of the columns in the paths of
+  config). Deleting a dataset from NAME_datasets deletes its rows.
+  """
+
+  def __init__(self, config, log, batch_rows=50000, indexes=None, normalize=None):
+    import tempfile
+
+    self.config = config
+    self.log = log
+    self.indexes = indexes
+    self.normalize = normalize
+    self.datasets = {}
+    self.keys = {}
+    self.batch_rows = None if batch_rows is None else max(1, int(batch_rows))
+    self.rows = []
+    self.n_batches = 0
+    self.n_rows = 0
+    os.makedirs(config['out_dir'], exist_ok=True)
+    self.tmp_dir = tempfile.mkdtemp(prefix=f".{config['name']}.", dir=config['out_dir'])
+
+  @property
+  def fname(self):
+    return os.path.join(self.config['out_dir'], f"{self.config['name']}.sql")
+
+  def add(self, rows):
+    if self.normalize is not None:
+      rows = [self._split(row) for row in rows]
+    self.rows.extend(rows)
+    while self.batch_rows is not None and len(self.rows) >= self.batch_rows:
+      batch = self.rows[:self.batch_rows]
+      self.rows = self.rows[self.batch_rows:]
+      self._flush(batch)
+
+  def close(self, hashes=None):
+    import shutil
+    import sqlite3
+
+    if len(self.rows) > 0 or self.n_batches == 0:
+      self._flush(self.rows)
+      self.rows = []
+
+    fname_tmp = os.path.join(self.tmp_dir, 'final', f"{self.config['name']}.sql")
+    if self.normalize is not None:
+      order = [column for paths in self.config.get('paths', {}).values() for column in paths]
+      normalize(fname_tmp, self.config['name'], order)
+
+    if hashes is not None:
+      conn = sqlite3.connect(fname_tmp)
+      try:
+        write_hashes(conn, hashes)
+        conn.commit()
+      finally:
+        conn.close()
+
+    if self.indexes is not None:
+      optimize(fname_tmp, self.indexes, self.log, analyze=True)
+
+    self.log.info(f'Writing {self.fname} ({self.n_rows} rows in {self.n_batches} batches)')
+    move_files(os.path.join(self.tmp_dir, 'final'), self.config['out_dir'], self.config['name'])
+    replace(self.fname, fname_tmp, self.log)
+    shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+  def _flush(self, batch):
+    import shutil
+    import tableui
+
+    # The first batch is written as is; later batches are written to a
+    # separate directory with the same name (so that dicts2table names their
+    # tables the same way) and appended.
+    sub_dir = 'final' if self.n_batches == 0 else 'part'
+    config = {**self.config, 'out_dir': os.path.join(self.tmp_dir, sub_dir)}
+    if self.normalize is not None:
+      # The columns moved to NAME_datasets are replaced by the key.
+      paths = {}
+      for path, columns_ in self.config.get('paths', {}).items():
+        paths[path] = {column: value for column, value in columns_.items() if column not in self.normalize}
+      paths.setdefault('/', {})
+      paths['/'] = {KEY: None, **paths['/']}
+      config['paths'] = paths
+    self.log.info(f"Writing batch {self.n_batches + 1} of {self.config['name']} ({len(batch)} rows)")
+    tableui.dicts2table(batch, config, logger=self.log)
+
+    fname_main = os.path.join(self.tmp_dir, 'final', f"{self.config['name']}.sql")
+    if self.n_batches > 0:
+      fname_part = os.path.join(self.tmp_dir, 'part', f"{self.config['name']}.sql")
+      append(fname_main, fname_part)
+      self._keep_files()
+      shutil.rmtree(os.path.join(self.tmp_dir, 'part'))
+    if self.normalize is not None:
+      self._write_datasets(fname_main)
+
+    self.n_batches += 1
+    self.n_rows += len(batch)
+
+  def _keep_files(self):
+    # Move files other than name.sql that a later batch wrote and the
+    # earlier batches did not to the directory of the first batch.
+    import filecmp
+
+    part_dir = os.path.join(self.tmp_dir, 'part')
+    final_dir = os.path.join(self.tmp_dir, 'final')
+    for fname in sorted(os.listdir(part_dir)):
+      if fname == f"{self.config['name']}.sql":
+        continue
+      fname_part = os.path.join(part_dir, fname)
+      fname_final = os.path.join(final_dir, fname)
+      if not os.path.exists(fname_final):
+        os.replace(fname_part, fname_final)
+      elif not filecmp.cmp(fname_part, fname_final, shallow=False):
+        msg = f'{fname} written by dicts2table() for batch {self.n_batches + 1} of {self.config["name"]} '
+        msg += 'differs from that of an earlier batch. Keeping the earlier one. Set batch_rows to null '
+        msg += 'to write all rows with a single call to dicts2table().'
+        self.log.warning(msg)
+
+  def _split(self, row):
+    id_ = (row.get('server'), row.get('dataset'))
+    if id_ not in self.keys:
+      self.keys[id_] = len(self.keys) + 1
+    key = self.keys[id_]
+    if key not in self.datasets:
+      self.datasets[key] = {column: row.get(column) for column in self.normalize}
+    return {KEY: key, **{column: value for column, value in row.items() if column not in self.normalize}}
+
+  def _write_datasets(self, fname):
+    # Datasets of rows written so far; a dataset whose rows span batches is
+    # written again with the same key, which replaces it.
+    import json
+    import sqlite3
+
+    def value(x):
+      if x is None or isinstance(x, (int, float, str)):
+        return x
+      return json.dumps(x)
+
+    table = quote(f"{self.config['name']}_datasets")
+    names = ', '.join(quote(column) for column in [KEY, *self.normalize])
+    conn = sqlite3.connect(fname)
+    try:
+      columns_ = ', '.join(f'{quote(column)} TEXT' for column in self.normalize)
+      conn.execute(f'CREATE TABLE IF NOT EXISTS {table} ({quote(KEY)} INTEGER PRIMARY KEY, {columns_})')
+      placeholders = ', '.join('?' for _ in range(len(self.normalize) + 1))
+      rows = [[key, *[value(dataset[column]) for column in self.normalize]] for key, dataset in self.datasets.items()]
+      conn.executemany(f'INSERT OR REPLACE INTO {table} ({names}) VALUES ({placeholders})', rows)
+      conn.commit()
+    finally:
+      conn.close()
+    self.datasets = {}
+
+
+def normalize(fname, name, order):
+  """
+  Rename table name in the SQLite file fname (written by TableWriter with
+  normalize) to NAME_rows, with x_datasetKey as an INTEGER column, create the
+  view name that joins it with NAME_datasets, with the columns in order
+  first, and a trigger that deletes the rows of datasets deleted from
+  NAME_datasets. Raises RuntimeError if the rows of a dataset are not found
+  with the index on x_datasetKey (see check_plan()).
+  """
+  import sqlite3
+
+  rows = quote(f'{name}_rows')
+  datasets = quote(f'{name}_datasets')
+  conn = sqlite3.connect(fname)
+  try:
+    # dicts2table() infers the type of x_datasetKey, which must be INTEGER,
+    # as in NAME_datasets, for the join to use the index.
+    types = columns(conn, name, 'main')
+    defs = ', '.join(f"{quote(column)} {'INTEGER' if column == KEY else type_}" for column, type_ in types.items())
+    names = ', '.join(quote(column) for column in types)
+    select = ', '.join(f'CAST({quote(column)} AS INTEGER)' if column == KEY else quote(column) for column in types)
+    conn.execute(f'CREATE TABLE {rows} ({defs})')
+    conn.execute(f'INSERT INTO {rows} ({names}) SELECT {select} FROM {quote(name)} ORDER BY rowid')
+    conn.execute(f'DROP TABLE {quote(name)}')
+    conn.execute(f'CREATE INDEX {quote(f"idx_{name}_rows_{KEY}")} ON {rows} ({quote(KEY)})')
+    conn.execute(f'''CREATE TRIGGER {quote(f'{name}_datasets_delete')} AFTER DELETE ON {datasets} BEGIN
+      DELETE FROM {rows} WHERE {quote(KEY)} = old.{quote(KEY)};
+    END''')
+    _create_view(conn, name, order)
+    check_plan(conn, name)
+    conn.commit()
+  finally:
+    conn.close()
+
+
+def check_plan(conn, name):
+  """
+  Raise RuntimeError if the query plan for the rows of a dataset in the view
+  name of normalized tables does not use the index on x_datasetKey of
+  NAME_rows.
+  """
+  index = f'idx_{name}_rows_{KEY}'
+  sql = f'EXPLAIN QUERY PLAN SELECT * FROM {quote(name)} WHERE dataset = ?'
+  plan = [row[-1] for row in conn.execute(sql, ('',))]
+  if not any(detail.startswith('SEARCH') and index in detail for detail in plan):
+    raise RuntimeError(f"Query for the rows of a dataset in {name} does not use {index}. Plan: {'; '.join(plan)}")
+
+
+def normalized(fname, name):
+  """
+  Return True if table name in the SQLite file fname is a normalized view
+  whose NAME_rows has an INTEGER x_datasetKey column.
+  """
+  import sqlite3
+
+  conn = sqlite3.connect(fname)
+  try:
+    if name not in _views(conn):
+      return False
+    return columns(conn, f'{name}_rows', 'main').get(KEY, '').upper() == 'INTEGER'
+  finally:
+    conn.close()
+
+
+def append(fname_main, fname_part):
+  """
+  Merge the tables in the SQLite file fname_part into those with the same
+  name in fname_main. Rows of tables with a server or x_datasetKey column
+  are appended; rows of other tables (e.g., metadata dicts2table() writes)
+  are added if fname_main does not have them. Tables and columns that
+  fname_main does not have are added.
+  """
+  import sqlite3
+
+  conn = sqlite3.connect(fname_main)
+  try:
+    conn.execute('ATTACH DATABASE ? AS part', (fname_part,))
+    _append(conn, 'part')
+    for table in tables(conn, 'part'):
+      if table != SERVERS_TABLE and table not in row_tables(conn, 'part'):
+        _append_table(conn, 'part', table, distinct=True)
+    conn.commit()
+    conn.execute('DETACH DATABASE part')
+  finally:
+    conn.close()
+
+
+def move_files(src_dir, dst_dir, name):
+  """
+  Move the files other than name.sql that dicts2table() wrote to src_dir to
+  dst_dir, replacing those in dst_dir.
+  """
+  for fname in sorted(os.listdir(src_dir)):
+    if fname != f'{name}.sql' and os.path.isfile(os.path.join(src_dir, fname)):
+      os.replace(os.path.join(src_dir, fname), os.path.join(dst_dir, fname))
+
+
+def replace(fname, fname_new, log):
+  """
+  Replace the SQLite file fname with the SQLite file fname_new, which is
+  removed.
+
+  If fname exists, it may be in WAL mode and open by readers, so it is not
+  renamed over (its -wal and -shm files would then be used with the new
+  file). Instead, the content of fname_new is copied into it with the
+  backup API in a single transaction, so readers see either the old or the
+  new content, and the WAL is then checkpointed and truncated.
+  """
+  import sqlite3
+
+  if not os.path.exists(fname):
+    os.replace(fname_new, fname)
+    return
+
+  src = sqlite3.connect(fname_new)
+  dst = sqlite3.connect(fname, timeout=60)
+  try:
+    # The page size of a database in WAL mode can not be changed by a
+    # backup, so fname_new is given that of fname.
+    page_size = dst.execute('PRAGMA page_size').fetchone()[0]
+    if src.execute('PRAGMA page_size').fetchone()[0] != page_size:
+      src.execute(f'PRAGMA page_size = {int(page_size)}')
+      src.execute('VACUUM')
+    src.backup(dst)
+    journal_mode = dst.execute('PRAGMA journal_mode').fetchone()[0]
+    if journal_mode.lower() == 'wal':
+      busy = dst.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()[0]
+      if busy:
+        log.info(f'Could not truncate the WAL of {fname} because it is in use. It will be checkpointed later.')
+  finally:
+    src.close()
+    dst.close()
+  os.remove(fname_new)
+
+
+def update(fname, fname_part, servers, hashes, log):
+  """
+  Replace the rows of servers in the SQLite file fname with those in the
+  SQLite file fname_part (None if there are no new rows) and store hashes,
+  {server: sha256}, for them (servers not in hashes are removed).
+
+  The file is updated in place in a single transaction in WAL mode, so
+  readers (e.g., tableui-serve) see either the old or the new rows and are
+  not blocked while the update is written.
+  """
+  import sqlite3
+
+  conn = sqlite3.connect(fname, timeout=60, isolation_level=None)
+  try:
+    journal_mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+    if journal_mode.lower() != 'wal':
+      log.warning(f'Could not set WAL journal mode for {fname} (mode is {journal_mode}). Readers may be blocked during the update.')
+    if fname_part is not None:
+      conn.execute('ATTACH DATABASE ? AS part', (fname_part,))
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+      # Rows of normalized tables are deleted by a trigger when their
+      # dataset is deleted.
+      for table in server_tables(conn, 'main'):
+        sql = f'DELETE FROM main.{quote(table)} WHERE server = ?'
+        conn.executemany(sql, [(server,) for server in servers])
+      if fname_part is not None:
+        # Keys of the new datasets follow those in fname.
+        for name in _views(conn):
+          if f'{name}_datasets' in tables(conn, 'part'):
+            sql = f'SELECT COALESCE(MAX({quote(KEY)}), 0) FROM main.{quote(f"{name}_datasets")}'
+            offset = conn.execute(sql).fetchone()[0]
+            # Through negative keys, as keys of NAME_datasets are unique.
+            for table in [f'{name}_datasets', f'{name}_rows']:
+              conn.execute(f'UPDATE part.{quote(table)} SET {quote(KEY)} = -({quote(KEY)} + ?)', (offset,))
+              conn.execute(f'UPDATE part.{quote(table)} SET {quote(KEY)} = -{quote(KEY)}')
+        _append(conn, 'part')
+        # Add columns that were added to NAME_rows.
+        for name in _views(conn):
+          order = list(columns(conn, name, 'main'))
+          _create_view(conn, name, order)
+      write_hashes(conn, {})
+      conn.executemany(f'DELETE FROM main.{SERVERS_TABLE} WHERE server = ?', [(server,) for server in servers])
+      write_hashes(conn, {server: hashes[server] for server in servers if server in hashes})
+      conn.execute('COMMIT')
+    except BaseException:
+      conn.execute('ROLLBACK')
+      raise
+
+    if fname_part is not None:
+      conn.execute('DETACH DATABASE part')
+    conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+  finally:
+    conn.close()
+
+
+def optimize(fname, indexes, log, analyze=False):
+  """
+  Prepare the row tables in the SQLite file fname for queries by creating an
+  index for each list of columns in indexes. Lists with columns that a table
+  does not have are skipped, and existing indexes are kept. FTS5 tables
+  (TABLE_fts) and their triggers written by earlier versions are removed, as
+  tableui-serve does not use them. Statistics for the query planner are then
+  updated with ANALYZE if analyze is True or anything was created and
+  otherwise with PRAGMA optimize.
+  """
+  import sqlite3
+
+  conn = sqlite3.connect(fname, timeout=60, isolation_level=None)
+  try:
+    existing = set(row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('index', 'table')"))
+    created = []
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+      for table in row_tables(conn, 'main'):
+        table_columns = columns(conn, table, 'main')
+        for index_columns in indexes or []:
+          if not all(column in table_columns for column in index_columns):
+            continue
+          name = f"idx_{table}_{'_'.join(index_columns)}"
+          if name in existing:
+            continue
+          names = ', '.join(quote(column) for column in index_columns)
+          conn.execute(f'CREATE INDEX {quote(name)} ON {quote(table)} ({names})')
+          created.append(name)
+
+
+        if f'{table}_fts' in existing:
+          for trigger in ['insert', 'delete', 'update']:
+            conn.execute(f"DROP TRIGGER IF EXISTS {quote(f'{table}_fts_{trigger}')}")
+          conn.execute(f"DROP TABLE {quote(f'{table}_fts')}")
+          log.info(f'Removed {table}_fts from {fname}')
+      conn.execute('COMMIT')
+    except BaseException:
+      conn.execute('ROLLBACK')
+      raise
+
+    if len(created) > 0:
+      log.info(f"Created in {fname}: {', '.join(created)}")
+    if analyze or len(created) > 0:
+      log.info(f'Running ANALYZE on {fname}')
+      conn.execute('ANALYZE')
+    else:
+      conn.execute('PRAGMA optimize')
+  finally:
+    conn.close()
+
+
+def read_hashes(fname):
+  """
+  Return {server: sha256} stored in the SQLite file fname, with None for
+  servers that have rows but no stored hash, or None if fname does not exist.
+  """
+  import sqlite3
+
+  if not os.path.exists(fname):
+    return None
+
+  conn = sqlite3.connect(fname)
+  try:
+    hashes = {}
+    for table in server_tables(conn, 'main'):
+      for (server,) in conn.execute(f'SELECT DISTINCT server FROM {quote(table)}'):
+        hashes[server] = None
+    if SERVERS_TABLE in tables(conn, 'main'):
+      for server, sha256 in conn.execute(f'SELECT server, sha256 FROM {SERVERS_TABLE}'):
+        hashes[server] = sha256
+    return hashes
+  finally:
+    conn.close()
+
+
+def write_hashes(conn, hashes, schema='main'):
+  """Insert or replace {server: sha256} in the servers table of schema."""
+  conn.execute(f'CREATE TABLE IF NOT EXISTS {schema}.{SERVERS_TABLE} (server TEXT PRIMARY KEY, sha256 TEXT)')
+  sql = f'INSERT OR REPLACE INTO {schema}.{SERVERS_TABLE} (server, sha256) VALUES (?, ?)'
+  conn.executemany(sql, list(hashes.items()))
+
+
+def _create_view(conn, name, order):
+  # (Re-)create the view name of normalized tables NAME_rows and
+  # NAME_datasets with the columns in order first. The rowid of NAME_rows
+  # is the last column, rowid, as views have no rowid of their own. Rows are
+  # ordered by dataset key and then rowid, i.e., in the order they were
+  # added (see TableWriter), which the index on the key of NAME_rows gives
+  # without sorting.
+  rows = columns(conn, f'{name}_rows', 'main')
+  datasets = columns(conn, f'{name}_datasets', 'main')
+  sources = {}
+  for column in [*order, *rows, *datasets]:
+    if column == KEY or column in sources:
+      continue
+    if column in datasets:
+      sources[column] = 'd'
+    elif column in rows:
+      sources[column] = 'r'
+  select = ', '.join(f'{source}.{quote(column)}' for column, source in sources.items())
+  conn.execute(f'DROP VIEW IF EXISTS {quote(name)}')
+  sql = f'CREATE VIEW {quote(name)} AS SELECT {select}, r.rowid AS rowid '
+  sql += f'FROM {quote(f"{name}_rows")} AS r JOIN {quote(f"{name}_datasets")} AS d ON r.{quote(KEY)} = d.{quote(KEY)} '
+  sql += f'ORDER BY d.{quote(KEY)}, r.rowid'
+  conn.execute(sql)
+
+
+def _views(conn):
+  # Names of views of normalized tables.
+  names = tables(conn, 'main')
+  views = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'view'")]
+  return [view for view in views if f'{view}_rows' in names and f'{view}_datasets' in names]
+
+
+def _append(conn, schema):
+  # Append rows of the row tables in schema to those in main.
+  for table in row_tables(conn, schema):
+    _append_table(conn, schema, table)
+
+
+def _append_table(conn, schema, table, distinct=False):
+  # Append rows of table in schema to table in main, creating it and adding
+  # columns that main does not have. If distinct, only rows that main does
+  # not have are appended.
+  part_columns = columns(conn, table, schema)
+  if table not in tables(conn, 'main'):
+    sql = conn.execute(f"SELECT sql FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+    conn.execute(sql)
+  main_columns = columns(conn, table, 'main')
+  for column, type_ in part_columns.items():
+    if column not in main_columns:
+      conn.execute(f'ALTER TABLE main.{quote(table)} ADD COLUMN {quote(column)} {type_}')
+  names = ', '.join(quote(column) for column in part_columns)
+  sql = f'INSERT INTO main.{quote(table)} ({names}) SELECT {names} FROM {schema}.{quote(table)}'
+  if distinct:
+    sql += f' EXCEPT SELECT {names} FROM main.{quote(table)}'
+  conn.execute(sql)
+
+
+def tables(conn, schema='main'):
+  """Return the names of the tables (not views or virtual tables) in schema."""
+  sql = f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+  sql += " AND sql NOT LIKE 'CREATE VIRTUAL TABLE%'"
+  return [row[0] for row in conn.execute(sql)]
+
+
+def row_tables(conn, schema='main'):
+  """Return the names of the tables in schema that have a server or x_datasetKey column."""
+  names = [table for table in tables(conn, schema) if table != SERVERS_TABLE]
+  return [table for table in names if {'server', KEY} & set(columns(conn, table, schema))]
+
+
+def server_tables(conn, schema='main'):
+  """Return the names of the tables in schema that have a server column."""
+  return [table for table in row_tables(conn, schema) if 'server' in columns(conn, table, schema)]
+
+
+def columns(conn, table, schema='main'):
+  """Return {column: type} for table in schema, in column order."""
+  rows = conn.execute(f'PRAGMA {schema}.table_info({quote(table)})')
+  return {row[1]: row[2] for row in rows}
+
+
+def quote(identifier):
+  return '"' + identifier.replace('"', '""') + '"'
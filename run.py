@@ -17,6 +17,89 @@ def _email(to, subject, body):
     server.send_message(msg, from_addr=to, to_addrs=[to])
 
 
+def _argv(args):
+  argv = [sys.argv[0]]
+  if args.servers is not None:
+    argv.extend(['--servers', ','.join(args.servers)])
+  if args.n_servers is not None:
+    argv.extend(['--n-servers', str(args.n_servers)])
+  if args.n_datasets is not None:
+    argv.extend(['--n-datasets', str(args.n_datasets)])
+  if args.use_remote_catalog:
+    argv.append('--use-remote-catalog')
+  if args.engine is not None:
+    argv.extend(['--engine', args.engine])
+  if args.incremental:
+    argv.append('--incremental')
+  if args.resume:
+    argv.append('--resume')
+  if args.workers is not None:
+    argv.extend(['--workers', str(args.workers)])
+  return argv
+
+
+def _run(command_name, argv):
+  """Run generator command_name. Returns (command_name, ok, seconds)."""
+  import time
+
+  start = time.time()
+  sys.argv = argv
+  try:
+    module_name = f'hapimeta.generators.{command_name}'
+    module = importlib.import_module(module_name)
+    module.run()
+  except Exception as e:
+    # Trigger the global exception handler, which the logger is configured to
+    # handle by writing the exception to the console and to the log file.
+    sys.excepthook(type(e), e, e.__traceback__)
+    return command_name, False, time.time() - start
+
+  return command_name, True, time.time() - start
+
+
+def _run_parallel(command_names, argv, jobs, log):
+  """
+  Run generators in up to jobs processes. A generator is started when all of
+  the generators it depends on (see hapimeta.cli.dependencies()) have
+  finished, so, e.g., availabilities, relations, spase, and table run at the
+  same time after catalogs.
+  """
+  import concurrent.futures
+
+  dependencies = importlib.import_module('hapimeta.cli').dependencies()
+
+  results = []
+  waiting = list(command_names)
+  finished = set()
+  running = {}
+  with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+    while waiting or running:
+      for command_name in list(waiting):
+        # Dependencies not being run (e.g., if a command was given) are ignored.
+        deps = [dep for dep in dependencies.get(command_name, []) if dep in command_names]
+        if all(dep in finished for dep in deps):
+          log.info(f'Starting {command_name}')
+          future = pool.submit(_run, command_name, argv)
+          running[future] = command_name
+          waiting.remove(command_name)
+
+      done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        command_name = running.pop(future)
+        try:
+          result = future.result()
+        except Exception as e:
+          # Process died, e.g., due to a segfault or being killed.
+          log.error(f'{command_name} failed: {e}')
+          result = (command_name, False, None)
+        log.info(f'Finished {command_name}')
+        results.append(result)
+        # As when run sequentially, dependents run even if a generator fails.
+        finished.add(command_name)
+
+  return results
+
+
 def main():
   args = hapimeta.cli()
   if args.command is None:
@@ -24,27 +107,27 @@ def main():
   else:
     command_names = [args.command]
 
-  for command_name in command_names:
-    sys.argv = [sys.argv[0]]
-    if args.servers is not None:
-      sys.argv.extend(['--servers', ','.join(args.servers)])
-    if args.n_servers is not None:
-      sys.argv.extend(['--n-servers', str(args.n_servers)])
-    if args.n_datasets is not None:
-      sys.argv.extend(['--n-datasets', str(args.n_datasets)])
-    if args.use_remote_catalog:
-      sys.argv.append('--use-remote-catalog')
-    try:
-      module_name = f'hapimeta.generators.{command_name}'
-      module = importlib.import_module(module_name)
-      module.run()
-    except Exception as e:
-      # Trigger the global exception handler, which the logger is configured to
-      # handle by writing the exception to the console and to the log file.
-      sys.excepthook(type(e), e, e.__traceback__)
-      continue
+  log = hapimeta.logger('run')
+  argv = _argv(args)
 
+  if args.jobs is not None and args.jobs > 1 and len(command_names) > 1:
+    results = _run_parallel(command_names, argv, args.jobs, log)
+    # hapimeta.error.combine() assumes that no generator is writing error
+    # files, so it is only called after all have finished.
     hapimeta.error.combine()
+  else:
+    results = []
+    for command_name in command_names:
+      result = _run(command_name, argv)
+      results.append(result)
+      if result[1]:
+        hapimeta.error.combine()
+
+  log.info('Generator timings:')
+  for command_name, ok, seconds in results:
+    status = 'ok' if ok else 'failed'
+    seconds = 'unknown' if seconds is None else f'{seconds:.1f} s'
+    log.info(f'  {command_name}: {seconds} ({status})')
 
 
 if __name__ == '__main__':
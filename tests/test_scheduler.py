@@ -0,0 +1,53 @@
+import time
+import threading
+
+from hapimeta import scheduler
+
+
+def test_fan_out_runs_concurrently():
+  # One seed task returns n tasks, as in the depth=all fallback of the
+  # catalogs command where a server's /catalog task returns its /info tasks.
+  n = 20
+  lock = threading.Lock()
+  state = {'running': 0, 'max_running': 0, 'done': []}
+
+  def func(key, task):
+    if task == 'seed':
+      return list(range(n))
+    with lock:
+      state['running'] += 1
+      state['max_running'] = max(state['max_running'], state['running'])
+    time.sleep(0.05)
+    with lock:
+      state['running'] -= 1
+      state['done'].append(task)
+
+  keys_done = []
+  start = time.time()
+  scheduler.run({'server': ['seed']}, func, max_workers=10, on_key_done=keys_done.append)
+  elapsed = time.time() - start
+
+  assert sorted(state['done']) == list(range(n))
+  assert state['max_running'] == 10
+  assert elapsed < n * 0.05 / 2
+  assert keys_done == ['server']
+
+
+def test_max_per_key():
+  lock = threading.Lock()
+  state = {'running': {}, 'max_running': {}}
+
+  def func(key, task):
+    with lock:
+      state['running'][key] = state['running'].get(key, 0) + 1
+      state['max_running'][key] = max(state['max_running'].get(key, 0), state['running'][key])
+    time.sleep(0.02)
+    with lock:
+      state['running'][key] -= 1
+
+  tasks = {'a': list(range(10)), 'b': list(range(10)), 'c': []}
+  keys_done = []
+  scheduler.run(tasks, func, max_workers=8, max_per_key=2, on_key_done=keys_done.append)
+
+  assert state['max_running'] == {'a': 2, 'b': 2}
+  assert sorted(keys_done) == ['a', 'b', 'c']
@@ -0,0 +1,97 @@
+import os
+import types
+import shutil
+import sqlite3
+
+import pytest
+
+pytest.importorskip('tableui')
+pytest.importorskip('utilrsw')
+
+import hapimeta
+from hapimeta.generators import table
+
+
+def catalog(server, n_datasets, title='Dataset', extra=None):
+  datasets = []
+  for idx in range(n_datasets):
+    parameters = [{'name': 'Time', 'type': 'isotime', 'units': 'UTC', 'length': 24}]
+    parameters.append({'name': f'p{idx}', 'type': 'double', 'units': 'nT'})
+    info = {
+      'startDate': f'20{idx:02d}-01-01Z',
+      'stopDate': '2030-01-01Z',
+      'cadence': 'PT1M',
+      'parameters': parameters,
+      'x_LastUpdate': '2026-01-01T00:00:00Z'
+    }
+    datasets.append({'id': f'{server}_ds{idx}', 'title': f'{title} {idx}', 'info': {**info, **(extra or {})}})
+  return {'catalog': {'catalog': datasets, 'x_LastUpdate': '2026-01-01T00:00:00Z'}}
+
+
+def config(out_dir):
+  cfg = hapimeta.config('table')
+  cfg = {**cfg, 'dicts2table': {kind: {**cfg['dicts2table'][kind], 'out_dir': out_dir} for kind in cfg['dicts2table']}}
+  return cfg
+
+
+def contents(out_dir):
+  # {file: content}, with the columns of each table and view of SQLite files
+  # and their rows (sorted, as updated servers are written after the others)
+  # for the row tables, views, and the servers table. Other tables that
+  # dicts2table() writes may have metadata of the call that wrote them
+  # (e.g., a row count), which update() does not change.
+  result = {}
+  for fname in sorted(os.listdir(out_dir)):
+    path = os.path.join(out_dir, fname)
+    if not fname.endswith('.sql'):
+      with open(path, 'rb') as fin:
+        result[fname] = fin.read()
+      continue
+    conn = sqlite3.connect(path)
+    try:
+      sql = "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%'"
+      names = sorted(row[0] for row in conn.execute(sql))
+      compared = [*hapimeta.tabledb.row_tables(conn), *hapimeta.tabledb._views(conn), hapimeta.tabledb.SERVERS_TABLE]
+      tables = {}
+      for name in names:
+        columns = [row[1] for row in conn.execute(f'PRAGMA table_info({hapimeta.tabledb.quote(name)})')]
+        if name not in compared:
+          tables[name] = (columns, None)
+          continue
+        # Keys and rowids depend on the order in which rows were written.
+        columns_ = [column for column in columns if column not in (hapimeta.tabledb.KEY, 'rowid')]
+        select = ', '.join(hapimeta.tabledb.quote(column) for column in columns_)
+        rows = sorted(map(repr, conn.execute(f'SELECT {select} FROM {hapimeta.tabledb.quote(name)}')))
+        tables[name] = (columns, rows)
+      result[fname] = tables
+    finally:
+      conn.close()
+  return result
+
+
+def test_incremental_matches_full_build(tmp_path, monkeypatch):
+  args = types.SimpleNamespace(servers=None, n_servers=None, n_datasets=None)
+  before = {'A': catalog('A', 3), 'B': catalog('B', 5), 'C': catalog('C', 2)}
+  # B changed, C removed, and D, with a column the others do not have, added.
+  after = {'A': catalog('A', 3), 'B': catalog('B', 6, title='New'), 'D': catalog('D', 4, extra={'contact': 'D'})}
+
+  # The same out_dir is used for both, as it is part of the hashes. Rows are
+  # not batched, as other files dicts2table() writes are kept from the first
+  # batch (see TableWriter).
+  out_dir = str(tmp_path / 'table')
+  monkeypatch.setattr(table, 'cfg', config(out_dir))
+
+  all = hapimeta.shards.Shards.from_dict(after)
+  table.build(all, args, table.server_hashes(all), None)
+  full = contents(out_dir)
+  shutil.rmtree(out_dir)
+
+  all = hapimeta.shards.Shards.from_dict(before)
+  table.build(all, args, table.server_hashes(all), None)
+  all = hapimeta.shards.Shards.from_dict(after)
+  assert table.update(all, args, table.server_hashes(all), None)
+  incremental = contents(out_dir)
+
+  assert sorted(full) == sorted(incremental)
+  for fname in full:
+    assert full[fname] == incremental[fname], fname